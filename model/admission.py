@@ -0,0 +1,84 @@
+import os
+import time
+
+# Requests a worker serves concurrently, beyond it new ones are rejected, 0 (default) disables the limit
+max_in_flight = int(os.environ.get('MAX_IN_FLIGHT', 0))
+
+# Requests queued longer than this before reaching the worker are rejected, the
+# queue of a busy gevent worker sits in front of Flask and isn't seen as in-flight, 0 (default) disables it
+max_queue_ms = float(os.environ.get('MAX_QUEUE_MS', 0))
+
+# Seconds a rejected client is asked to wait before retrying
+retry_after = int(os.environ.get('RETRY_AFTER_SECONDS', 1))
+
+# Client time budget in milliseconds, counted from nginx accepting the request.
+# SageMaker only forwards the custom attributes header, e.g. `timeout-ms=200`
+timeout_header = 'X-Request-Timeout-Ms'
+attributes_header = 'X-Amzn-SageMaker-Custom-Attributes'
+timeout_attribute = 'timeout-ms'
+
+
+def get_timeout_ms(headers):
+    """ Time budget of a request set by the client.
+
+    Args:
+        headers: Request headers.
+
+    Returns: The budget in milliseconds, None without a valid one.
+    """
+    value = headers.get(timeout_header)
+    if value is None:
+        for attribute in headers.get(attributes_header, '').split(','):
+            key, _, attribute_value = attribute.partition('=')
+            if key.strip() == timeout_attribute:
+                value = attribute_value
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def get_deadline(headers, queue_wait_ms):
+    """ Monotonic time after which the client no longer waits for the response.
+
+    Args:
+        headers: Request headers.
+        queue_wait_ms: (float) Time already spent queued, see `metrics.get_queue_wait_ms`.
+
+    Returns: The deadline, None if the client set no budget.
+    """
+    timeout_ms = get_timeout_ms(headers)
+    if timeout_ms is None:
+        return None
+    return time.monotonic() + (timeout_ms - (queue_wait_ms or 0.0)) / 1000
+
+
+def is_expired(deadline, service_ms=0.0):
+    """ Whether the response can no longer reach the client in time.
+
+    Args:
+        deadline: (float) Deadline of the request, see `get_deadline`.
+        service_ms: (float) Expected time to serve the request.
+    """
+    return deadline is not None and time.monotonic() + service_ms / 1000 >= deadline
+
+
+def admit(in_flight, queue_wait_ms, deadline, service_ms):
+    """ Decide whether a worker takes a new request.
+
+    Args:
+        in_flight: (int) Requests in progress in the worker.
+        queue_wait_ms: (float) Time the request spent queued, None if unknown.
+        deadline: (float) Deadline of the request, see `get_deadline`.
+        service_ms: (float) Recent latency of the worker.
+
+    Returns: None to admit the request, otherwise the rejection reason,
+        'saturated' or 'expired'.
+    """
+    if is_expired(deadline, service_ms):
+        return 'expired'
+    if max_in_flight > 0 and in_flight >= max_in_flight:
+        return 'saturated'
+    if max_queue_ms > 0 and queue_wait_ms is not None and queue_wait_ms > max_queue_ms:
+        return 'saturated'
+    return None
@@ -1,44 +1,124 @@
 #!/usr/bin/env python
 
+import time
+
+# Start of the worker imports, reported in the startup report
+import_start = time.perf_counter()
+
 import io
+import csv
+import json
 import sys
 import os
 import signal
+import shutil
 import flask
 import multiprocessing
 import subprocess
-import model
-import pandas as pd
+import features
+import runtimes
+import capture
+import metrics
+import shadow
+import multimodel
+import warmup
+import admission
 import numpy as np
-import tensorflow as tf
-from tensorflow import keras
+
+# Serving imports only what the request path needs, `model` and TensorFlow are
+# imported by the training and test modes and by the model backends
 
 # Adds the model.py path to the list
 prefix = '/opt/ml'
 model_path = os.path.join(prefix, 'model')
 sys.path.insert(0,model_path)
-model_cache = {}
+
+# Startup timings of this worker process, see `report_startup`
+startup = {'pid': os.getpid(), 'import_seconds': time.perf_counter() - import_start}
+
+
+def report_startup(**timings):
+    """ Add timings to the startup report of the worker and print it.
+    """
+    startup.update(timings)
+    print("Startup Report: {}".format(json.dumps(startup)))
+
 
 class PredictionService(object):
     tf_model = None
+    preprocessor = None
+    shadow_model = None
+    # Real lock, the model is loaded by the warm-up thread or a request
+    load_lock = capture.get_original('threading', 'Lock')()
     @classmethod
     def get_model(cls):
-        if cls.tf_model is None:
-            cls.tf_model = load_model()
+        if cls.tf_model is not None:
+            return cls.tf_model
+        with cls.load_lock:
+            if cls.tf_model is not None:
+                return cls.tf_model
+            # Runtime backend of the exported inference artifacts, see `runtimes.py`
+            start_time = time.perf_counter()
+            backend = os.environ.get('MODEL_BACKEND', 'keras')
+            tf_model = runtimes.load_backend(backend, model_path)
+            cls.preprocessor = features.Preprocessor.load(model_path)
+            report_startup(backend=backend, model_load_seconds=time.perf_counter() - start_time)
+            # Candidate model scored in the background, see `shadow.py`, a
+            # failing candidate only disables the shadowing
+            if shadow.shadow_model:
+                try:
+                    cls.shadow_model = shadow.ShadowModel(shadow.shadow_model,
+                                                          os.environ.get('SHADOW_MODEL_BACKEND', backend))
+                except Exception as e:
+                    print("Shadow model disabled, failed to load {}: {}".format(shadow.shadow_model, e))
+            # Set last, requests only check the model
+            cls.tf_model = tf_model
         return cls.tf_model
 
     @classmethod
-    def predict(cls, input):
+    def warm_up(cls, rows):
+        """ Score a synthetic batch, bypassing the shadow model and the startup report.
+        """
+        return cls.tf_model.predict(cls.preprocessor.transform(rows))
+
+    @classmethod
+    def predict(cls, input, batch_size=None, model_id=None):
+        if model_id is not None and multimodel.registry is not None:
+            # Multi-model mode, see `multimodel.py`
+            tf_model, preprocessor = multimodel.registry.get(model_id)
+            return tf_model.predict(preprocessor.transform(input), batch_size=batch_size)
+
         tf_model = cls.get_model()
-        return tf_model.predict(input)
+        start_time = time.perf_counter()
+        predictions = tf_model.predict(cls.preprocessor.transform(input), batch_size=batch_size)
+        predict_ms = (time.perf_counter() - start_time) * 1000
+        if 'first_predict_ms' not in startup:
+            # Includes the graph tracing and kernel initialization of the backend
+            report_startup(first_predict_ms=predict_ms)
+        if cls.shadow_model is not None:
+            cls.shadow_model.submit(input, predictions, predict_ms)
+        return predictions
 
-def load_model():
-    """ Function to load the Keras model
+def parse_csv(text):
+    """ Parse the rows of a CSV request, featurized rows or raw records, as a string array
+    converted by the preprocessing.
     """
-    model = tf.keras.models.load_model(os.path.join(model_path, 'model.h5'))
-    model.compile(optimizer='adam', loss='mse')
-    return model
+    rows = [row for row in csv.reader(io.StringIO(text)) if row]
+    if not rows:
+        raise ValueError("Empty request, expected at least one row.")
+    if len(set(len(row) for row in rows)) > 1:
+        raise ValueError("Rows have different numbers of columns.")
+    return np.array(rows)
 
+def start_warmup():
+    """ Load the model and warm it up on a background thread, `/ping` reports
+    healthy once every worker has warmed up (see `warmup.py`).
+    """
+    if multimodel.registry is not None:
+        # Models of the multi-model mode are loaded on demand
+        warmup.worker.start(lambda: None, None, 0)
+    else:
+        warmup.worker.start(PredictionService.get_model, PredictionService.warm_up, len(features.feature_names))
 
 def sigterm_handler(nginx_pid, gunicorn_pid):
     """ Function to handle nginx processing job
@@ -65,6 +145,10 @@ def start_server(timeout, workers):
     subprocess.check_call(['ln', '-sf', '/dev/stdout', '/var/log/nginx/access.log'])
     subprocess.check_call(['ln', '-sf', '/dev/stderr', '/var/log/nginx/error.log'])
 
+    # Workers report healthy once all of them have warmed up
+    os.environ['MODEL_SERVER_WORKERS'] = str(workers)
+    shutil.rmtree(warmup.state_path, ignore_errors=True)
+
     nginx = subprocess.Popen(['nginx', '-c', '/opt/program/nginx.conf'])
     gunicorn = subprocess.Popen(['gunicorn',
                                  '--timeout', str(timeout),
@@ -88,29 +172,100 @@ def start_server(timeout, workers):
 # The flask app for serving predictions
 app = flask.Flask(__name__)
 
+@app.before_request
+def start_request():
+    if flask.request.path == '/invocations':
+        # Turn away work the worker can't start now or the client gave up on, see `admission.py`
+        queue_wait_ms = metrics.get_queue_wait_ms(flask.request.headers.get('X-Request-Start'))
+        flask.g.deadline = admission.get_deadline(flask.request.headers, queue_wait_ms)
+        rejection = admission.admit(metrics.tracker.current, queue_wait_ms, flask.g.deadline,
+                                    metrics.tracker.mean_latency_ms)
+        if rejection is not None:
+            metrics.tracker.reject(rejection)
+            return reject_request(rejection)
+
+        flask.g.start_time = time.perf_counter()
+        flask.g.rows = 0
+        metrics.tracker.start(queue_wait_ms)
+        if metrics.publisher is not None:
+            metrics.publisher.start()
+
+def reject_request(reason):
+    if reason == 'expired':
+        return flask.Response(response="Request deadline exceeded.", status=504, mimetype='text/plain')
+    return flask.Response(response="Server saturated, retry later.", status=503, mimetype='text/plain',
+                          headers={'Retry-After': str(admission.retry_after)})
+
+@app.after_request
+def add_timings(response):
+    # Logged by nginx for every request, the trace replayed by `scaling.py`
+    if 'start_time' in flask.g:
+        response.headers['X-Rows'] = str(flask.g.rows)
+        response.headers['X-Service-Ms'] = '{:.3f}'.format((time.perf_counter() - flask.g.start_time) * 1000)
+    return response
+
+@app.teardown_request
+def finish_request(exception=None):
+    if 'start_time' in flask.g:
+        metrics.tracker.finish((time.perf_counter() - flask.g.start_time) * 1000, rows=flask.g.rows)
+
 @app.route('/ping', methods=['GET'])
 def ping():
-    health = PredictionService.get_model() is not None
+    if warmup.worker.thread is not None:
+        health = warmup.worker.is_healthy()
+    else:
+        # Models of the multi-model mode are loaded on demand
+        health = multimodel.registry is not None or PredictionService.get_model() is not None
     status = 200 if health else 404
     return flask.Response(response='\n', status=status, mimetype='application/json')
 
+@app.route('/models', methods=['GET'])
+def models():
+    if multimodel.registry is None:
+        return flask.Response(response="Multi-model mode is disabled.", status=404, mimetype='text/plain')
+    return flask.Response(response=json.dumps(multimodel.registry.report()), status=200, mimetype='application/json')
+
 @app.route('/invocations', methods=['POST'])
 def invoke():
     data = None
     if flask.request.content_type == 'text/csv':
-        payload = np.fromstring(flask.request.data.decode('utf-8'), sep=',') # Convert `str` to `Numpy`
-        data = payload.reshape(1, -1) # Vectorize the payload
+        # One row per line, featurized rows or raw records
+        try:
+            data = parse_csv(flask.request.data.decode('utf-8'))
+        except ValueError as e:
+            return flask.Response(response=str(e), status=400, mimetype='text/plain')
+        flask.g.rows = len(data)
     else:
         return flask.Response(response="Invalid request data type, only 'text/csv' is supported.", 
                               status=415, mimetype='text/plain')
     
+    model_id = flask.request.headers.get(multimodel.target_header)
+    if multimodel.registry is not None and model_id is None:
+        return flask.Response(response="Missing '{}' header.".format(multimodel.target_header),
+                              status=400, mimetype='text/plain')
+
+    # Parsing may have used up the rest of the budget
+    if admission.is_expired(flask.g.deadline, metrics.tracker.mean_latency_ms):
+        metrics.tracker.reject('expired')
+        return reject_request('expired')
+
     # Get predictions
-    predictions = PredictionService.predict(data)
+    start_time = time.perf_counter()
+    try:
+        predictions = PredictionService.predict(data, model_id=model_id)
+    except KeyError as e:
+        return flask.Response(response="Model {} not found.".format(e), status=404, mimetype='text/plain')
+    except ValueError as e:
+        if capture.writer is not None and multimodel.registry is None:
+            capture.writer.record(data, status=400, latency_ms=(time.perf_counter() - start_time) * 1000)
+        return flask.Response(response=str(e), status=400, mimetype='text/plain')
 
-    # Convert from Numpy to CSV
-    out = io.StringIO()
-    pd.DataFrame({'results':predictions.flatten()}).to_csv(out, header=False, index=False)
-    result = out.getvalue()
+    # Buffered for the background capture thread, never waits on capture I/O
+    if capture.writer is not None and multimodel.registry is None:
+        capture.writer.record(data, predictions, latency_ms=(time.perf_counter() - start_time) * 1000)
+
+    # Convert from Numpy to CSV, one prediction per line
+    result = '\n'.join(str(value) for value in predictions.flatten().tolist()) + '\n'
     print("Prediction Result: {}".format(result))
 
     return flask.Response(response=result, status=200, mimetype='text/csv')
@@ -118,24 +273,64 @@ def invoke():
  
 if __name__ == '__main__':
 
-    print("Tensorflow Version: {}".format(tf.__version__))
-
-    if len(sys.argv) < 2 or ( not sys.argv[1] in [ "serve", "train", "test"] ):
-        raise Exception("Invalid argument: you must specify 'train' for training mode, 'serve' for predicting mode or 'test' for local testing.") 
+    if len(sys.argv) < 2 or ( not sys.argv[1] in [ "serve", "train", "test", "transform"] ):
+        raise Exception("Invalid argument: you must specify 'train' for training mode, 'serve' for predicting mode, 'transform' for batch scoring or 'test' for local testing.") 
 
     train = sys.argv[1] == "train"
     test = sys.argv[1] == "test"
+    batch = sys.argv[1] == "transform"
+
+    if train or test:
+        import tensorflow as tf
+        import model
+        print("Tensorflow Version: {}".format(tf.__version__))
 
     if train:
         model.train()
+
+    elif batch:
+        import transform
+        transform.main(sys.argv[2:])
         
     elif test:
-        algo = 'TensorflowRegression'
-        
-        if model_cache.get(algo) is None:
-            model_cache[algo] = load_model()
-        req = eval(sys.argv[2])
-        print(model.predict(req, model_cache[algo]))
+        import argparse
+        import contextlib
+        parser = argparse.ArgumentParser(prog='app.py test', description="Score rows locally like the endpoint")
+        parser.add_argument('payload', nargs='?', default='-',
+                            help="A row or list of rows as a literal, a file of rows (one per line) or '-' for stdin")
+        parser.add_argument('--batch-size', type=int, default=1, help="Rows per batch")
+        parser.add_argument('--quiet', action='store_true', help="Only print the timings")
+        args = parser.parse_args(sys.argv[2:])
+
+        print("Local Testing Mode ...")
+
+        # Same backend and preprocessing as the endpoint, see `MODEL_BACKEND`
+        PredictionService.get_model()
+
+        if args.payload == '-':
+            payload = contextlib.nullcontext(sys.stdin)
+        elif os.path.isfile(args.payload):
+            payload = open(args.payload, 'r')
+        else:
+            payload = contextlib.nullcontext([args.payload])
+
+        times = []
+        rows = 0
+        with payload as lines:
+            for i, batch in enumerate(model.iter_batches(lines, args.batch_size)):
+                start_time = time.perf_counter()
+                predictions = PredictionService.predict(batch, batch_size=args.batch_size)
+                times.append(time.perf_counter() - start_time)
+                rows += len(batch)
+                if not args.quiet:
+                    print(predictions.tolist())
+                print("Batch {}: {} rows in {:.2f} ms".format(i, len(batch), times[-1] * 1000))
+
+        if times:
+            # The first batch includes the graph tracing
+            print("Scored {} rows in {} batches, {:.0f} rows/s, batch latency p50 {:.2f} ms, p90 {:.2f} ms".format(
+                rows, len(times), rows / sum(times),
+                np.percentile(times, 50) * 1000, np.percentile(times, 90) * 1000))
 
     else:
         cpu_count = multiprocessing.cpu_count()
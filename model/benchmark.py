@@ -0,0 +1,72 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+from local_cluster import program_path, set_hyperparameters
+
+
+def run_training(prefix, **params):
+    """ Run a local training job with the given hyperparameters.
+
+    Args:
+        prefix: (str) Local replacement for the '/opt/ml' directory.
+        params: Hyperparameters set for this run on top of the job hyperparameters.
+
+    Returns: The scaling report of the run.
+    """
+    param_path = os.path.join(prefix, 'input/config/hyperparameters.json')
+    with open(param_path, 'r') as f:
+        hyperparameters = f.read()
+
+    # Start from scratch rather than resuming a previous run
+    shutil.rmtree(os.path.join(prefix, 'checkpoints'), ignore_errors=True)
+
+    try:
+        set_hyperparameters(prefix, **params)
+        env = dict(os.environ)
+        env['SM_PREFIX'] = prefix
+        env.pop('TF_CONFIG', None)
+        subprocess.check_call([sys.executable, '-c', 'import model; model.train()'], cwd=program_path, env=env)
+    finally:
+        # Restore the job hyperparameters for the next run
+        with open(param_path, 'w') as f:
+            f.write(hyperparameters)
+
+    with open(os.path.join(prefix, 'output/data/scaling.json'), 'r') as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prefix", type=str, default=os.environ.get("SM_PREFIX", "/opt/ml"))
+    parser.add_argument("--profile", type=str, default="performance")
+    parser.add_argument("--target-val-loss", type=float, required=True)
+    parser.add_argument("--mixed-precision", action="store_true", help="Train the profile in bfloat16 mixed precision")
+    args, _ = parser.parse_known_args()
+
+    print("Running current settings ...")
+    baseline = run_training(args.prefix, target_val_loss=args.target_val_loss)
+
+    print("Running '{}' profile ...".format(args.profile))
+    candidate = run_training(
+        args.prefix,
+        target_val_loss=args.target_val_loss,
+        profile=args.profile,
+        mixed_precision=str(args.mixed_precision).lower()
+    )
+
+    # Compare wall-clock time to reach the target validation loss
+    results = {'target_val_loss': args.target_val_loss}
+    for name, report in [('baseline', baseline), (args.profile, candidate)]:
+        results[name] = {
+            'time_to_target_seconds': report['time_to_target_seconds'],
+            'duration_seconds': report['duration_seconds'],
+            'epochs': report['epochs'],
+            'best_val_loss': min(report['val_loss']),
+            'samples_per_second': report['samples_per_second']
+        }
+    if baseline['time_to_target_seconds'] and candidate['time_to_target_seconds']:
+        results['speedup'] = baseline['time_to_target_seconds'] / candidate['time_to_target_seconds']
+    print(json.dumps(results, indent=4))
@@ -19,29 +19,21 @@ def get_approved_package(package_group_name):
     Returns: The SageMaker Model Package ARN.
     """
     try:
-        # Get the latest approved model package
-        response = sm.list_model_packages(
+        # Newest packages first, stop at the first approved package
+        paginator = sm.get_paginator('list_model_packages')
+        pages = paginator.paginate(
             ModelPackageGroupName=package_group_name,
             ModelApprovalStatus="Approved",
             SortBy="CreationTime",
-            MaxResults=100,
+            SortOrder="Descending",
+            PaginationConfig={'PageSize': 100}
         )
-        approved_packages = response["ModelPackageSummaryList"]
-
-        # Fetch more packages if none returned with continuation token
-        while len(approved_packages) == 0 and "NextToken" in response:
-            logger.debug("Getting more packages for token: {}".format(response["NextToken"]))
-            response = sm.list_model_packages(
-                ModelPackageGroupName=package_group_name,
-                ModelApprovalStatus="Approved",
-                SortBy="CreationTime",
-                MaxResults=100,
-                NextToken=response["NextToken"],
-            )
-            approved_packages.extend(response["ModelPackageSummaryList"])
-
-        # Return error if no packages found
-        if len(approved_packages) == 0:
+        for page in pages:
+            if len(page["ModelPackageSummaryList"]) > 0:
+                break
+            logger.debug("Getting more packages for token: {}".format(page.get("NextToken")))
+        else:
+            # Return error if no packages found
             error_message = (
                 f"No approved ModelPackage found for ModelPackageGroup: {package_group_name}"
             )
@@ -49,7 +41,7 @@ def get_approved_package(package_group_name):
             raise Exception(error_message)
 
         # Return the pmodel package arn
-        model_package_arn = approved_packages[0]["ModelPackageArn"]
+        model_package_arn = page["ModelPackageSummaryList"][0]["ModelPackageArn"]
         logger.info(f"Identified the latest approved model package: {model_package_arn}")
 
         return model_package_arn
@@ -0,0 +1,227 @@
+import os
+import io
+import time
+import uuid
+import random
+import collections
+import numpy as np
+
+# Capture destination, a local directory or S3 prefix, capture is disabled when unset
+destination = os.environ.get('CAPTURE_DESTINATION')
+
+# Target number of captured rows per second and worker, beyond it requests are sampled out
+sampling_rate = float(os.environ.get('CAPTURE_ROWS_PER_SECOND', 10))
+
+# Predictions further than this many standard deviations from the running mean are always captured
+outlier_zscore = float(os.environ.get('CAPTURE_OUTLIER_ZSCORE', 3))
+
+# Flush a batch at this many rows, or after this many seconds
+flush_rows = int(os.environ.get('CAPTURE_FLUSH_ROWS', 10000))
+flush_seconds = float(os.environ.get('CAPTURE_FLUSH_SECONDS', 60))
+
+# Records buffered before new ones are dropped, the request path never waits on capture
+max_buffered = 100000
+
+
+def get_original(module, name):
+    """ The unpatched standard library object when gunicorn's gevent workers
+    monkey patched it, so the flush runs on a real thread.
+    """
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched(module):
+            return monkey.get_original(module, name)
+    except ImportError:
+        pass
+    return getattr(__import__(module), name)
+
+
+class TokenBucket(object):
+    """ Rate limiter allowing bursts of up to one second of rows.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def take(self, rows):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= rows:
+            self.tokens -= rows
+            return True
+        # Requests larger than the bucket still get an occasional chance
+        return self.tokens >= self.rate and random.random() < self.rate / rows
+
+
+class RunningStats(object):
+    """ Running mean and variance of the predictions, each request is merged
+    as a batch (Chan et al.) rather than value by value.
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        batch_mean = values.mean()
+        batch_m2 = np.square(values - batch_mean).sum()
+        total = self.count + len(values)
+        delta = batch_mean - self.mean
+        self.mean += delta * len(values) / total
+        self.m2 += batch_m2 + delta * delta * self.count * len(values) / total
+        self.count = total
+
+    def is_outlier(self, values):
+        if self.count < 100:
+            return False
+        std = np.sqrt(self.m2 / self.count)
+        return bool(std > 0 and np.any(np.abs(np.asarray(values) - self.mean) > outlier_zscore * std))
+
+
+class CaptureWriter(object):
+    """ Buffer captured requests and flush them as compressed columnar batches.
+
+    Records are appended to an in-memory buffer on the request path and written
+    by a background thread as `.npz` files with one array per column:
+    `timestamp`, `inputs`, `predictions`, `status`, `latency_ms` and `reason`.
+    """
+    def __init__(self, destination):
+        self.destination = destination.rstrip('/')
+        self.buffer = collections.deque()
+        self.bucket = TokenBucket(sampling_rate)
+        self.stats = RunningStats()
+        self.dropped = 0
+        self.sequence = 0
+        self.sleep = get_original('time', 'sleep')
+        self.s3 = None
+        if self.destination.startswith('s3://'):
+            import boto3
+            self.s3 = boto3.client('s3')
+        else:
+            os.makedirs(self.destination, exist_ok=True)
+        self.thread = None
+
+    def start(self):
+        """ Start the flush thread, once per worker process.
+        """
+        if self.thread is None:
+            self.thread = get_original('threading', 'Thread')(target=self.run, daemon=True)
+            self.thread.start()
+
+    def record(self, inputs, predictions=None, status=200, latency_ms=0.0):
+        """ Capture a request if it is an error, an outlier or sampled in.
+
+        Args:
+            inputs: (NumPy) Request rows, or None if the request could not be parsed.
+            predictions: (NumPy) Predictions, None for errors.
+            status: (int) Response status code.
+            latency_ms: (float) Time taken to predict.
+        """
+        rows = 1 if inputs is None else len(inputs)
+        if status != 200:
+            reason = 'error'
+        else:
+            predictions = np.asarray(predictions, dtype=np.float32).flatten()
+            outlier = self.stats.is_outlier(predictions)
+            self.stats.update(predictions)
+            if outlier:
+                reason = 'outlier'
+            elif self.bucket.take(rows):
+                reason = 'sampled'
+            else:
+                return
+
+        if len(self.buffer) >= max_buffered:
+            self.dropped += 1
+            return
+        self.start()
+        self.buffer.append((time.time(), inputs, predictions, status, latency_ms, reason))
+
+    def run(self):
+        last_flush = time.monotonic()
+        while True:
+            self.sleep(1)
+            if len(self.buffer) >= flush_rows or (self.buffer and time.monotonic() - last_flush >= flush_seconds):
+                self.flush()
+                last_flush = time.monotonic()
+
+    def flush(self):
+        """ Write the buffered records as one compressed batch.
+        """
+        records = []
+        while self.buffer and len(records) < flush_rows:
+            records.append(self.buffer.popleft())
+        if not records:
+            return
+
+        # One row per captured request row, requests of several rows are expanded
+        timestamps, inputs, predictions, status, latency, reason = [], [], [], [], [], []
+        for timestamp, rows, preds, code, ms, why in records:
+            rows = np.empty((1, 0)) if rows is None else np.asarray(rows)
+            preds = np.full(len(rows), np.nan, dtype=np.float32) if preds is None else preds
+            for row, pred in zip(rows, preds):
+                timestamps.append(timestamp)
+                inputs.append(row)
+                predictions.append(pred)
+                status.append(code)
+                latency.append(ms)
+                reason.append(why)
+
+        widths = set(len(row) for row in inputs)
+        columns = {
+            'timestamp': np.array(timestamps),
+            'predictions': np.array(predictions, dtype=np.float32),
+            'status': np.array(status, dtype=np.int16),
+            'latency_ms': np.array(latency, dtype=np.float32),
+            'reason': np.array(reason)
+        }
+        if len(widths) == 1:
+            try:
+                columns['inputs'] = np.array(inputs, dtype=np.float32)
+            except ValueError:
+                # Raw records with categorical columns
+                columns['inputs'] = np.array(inputs).astype(str)
+        else:
+            columns['inputs'] = np.array([','.join(str(value) for value in row) for row in inputs])
+        if self.dropped:
+            columns['dropped'] = np.array([self.dropped])
+            self.dropped = 0
+
+        out = io.BytesIO()
+        np.savez_compressed(out, **columns)
+        self.sequence += 1
+        name = time.strftime('%Y/%m/%d/%H/', time.gmtime(records[0][0])) + \
+            'capture-{}-{}-{:06d}.npz'.format(int(records[0][0]), uuid.uuid4().hex[:8], self.sequence)
+        try:
+            if self.s3 is not None:
+                bucket, _, prefix = self.destination[len('s3://'):].partition('/')
+                self.s3.put_object(Bucket=bucket, Key='{}/{}'.format(prefix, name), Body=out.getvalue())
+            else:
+                path = os.path.join(self.destination, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(out.getvalue())
+                os.replace(path + '.tmp', path)
+        except Exception as e:
+            print("Failed to write capture batch {}: {}".format(name, e))
+
+
+def load(path):
+    """ Read a capture batch written by `CaptureWriter`.
+
+    Args:
+        path: (str) Local `.npz` file.
+
+    Returns: A dictionary of the capture columns.
+    """
+    with np.load(path) as batch:
+        return {name: batch[name] for name in batch.files}
+
+
+# Capture writer of this worker process, None when capture is disabled
+writer = CaptureWriter(destination) if destination else None
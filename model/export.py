@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import shutil
+import numpy as np
+import tensorflow as tf
+import runtimes
+
+# Number of single row requests timed per backend
+latency_runs = 200
+
+
+def get_rss_mb():
+    """ Current resident set size of the process.
+
+    Returns: RSS in megabytes.
+    """
+    with open('/proc/self/statm', 'r') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def serving_function(model):
+    """ Trace the model into a concrete function with a batch-size agnostic signature.
+
+    Args:
+        model: (Model) Trained Keras model.
+
+    Returns: Concrete serving function.
+    """
+    spec = tf.TensorSpec([None, model.input_shape[-1]], tf.float32, name='inputs')
+    return tf.function(lambda inputs: model(inputs, training=False)).get_concrete_function(spec)
+
+
+def export_tflite(model, path, representative=None):
+    """ Export a TFLite model with dynamic-range quantization, or full int8
+    quantization when a representative dataset is given.
+
+    Args:
+        model: (Model) Trained Keras model.
+        path: (str) Output file.
+        representative: (NumPy) Sample of model inputs to calibrate int8 activations.
+    """
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([serving_function(model)])
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if representative is not None:
+        converter.representative_dataset = lambda: ([row[np.newaxis, :]] for row in representative.astype(np.float32))
+        # Integer kernels internally, float32 input and output for the serving code
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    with open(path, 'wb') as f:
+        f.write(converter.convert())
+
+
+def export_savedmodel(model, path):
+    """ Export a SavedModel with the variables folded into graph constants.
+
+    Args:
+        model: (Model) Trained Keras model.
+        path: (str) Output directory.
+    """
+    from tensorflow.python.framework.convert_to_constants import convert_variables_to_constants_v2
+
+    frozen = convert_variables_to_constants_v2(serving_function(model))
+    module = tf.Module()
+    module.serve = frozen
+    tf.saved_model.save(module, path, signatures={'serving_default': frozen})
+
+
+def export_onnx(model, path):
+    """ Export an ONNX model, requires the optional `tf2onnx` package.
+
+    Args:
+        model: (Model) Trained Keras model.
+        path: (str) Output file.
+    """
+    import tf2onnx
+
+    spec = (tf.TensorSpec([None, model.input_shape[-1]], tf.float32, name='inputs'),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, output_path=path)
+
+
+def benchmark(backend, X):
+    """ Time single row and full batch predictions of a backend.
+
+    Args:
+        backend: Loaded runtime backend.
+        X: (NumPy) Validation features.
+
+    Returns: A dictionary of latency metrics.
+    """
+    row = X[:1].astype(np.float32)
+    backend.predict(row)
+    times = []
+    for _ in range(latency_runs):
+        start_time = time.perf_counter()
+        backend.predict(row)
+        times.append(time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    backend.predict(X.astype(np.float32))
+    batch_seconds = time.perf_counter() - start_time
+
+    return {
+        'latency_p50_ms': float(np.percentile(times, 50)) * 1000,
+        'latency_p99_ms': float(np.percentile(times, 99)) * 1000,
+        'batch_rows_per_second': len(X) / batch_seconds
+    }
+
+
+def get_size_mb(path):
+    """ Size of an artifact file or directory on disk.
+    """
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(path) for name in names) / (1024 * 1024)
+    return os.path.getsize(path) / (1024 * 1024)
+
+
+def remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def export_all(model, model_path, val_X, formats, tolerance=0.01):
+    """ Export optimized inference artifacts next to `model.h5` and compare
+    them with the Keras model on the validation set. Artifacts failing to
+    export or drifting beyond the tolerance are logged and removed.
+
+    Args:
+        model: (Model) Trained Keras model, already saved as `model.h5`.
+        model_path: (str) Model directory.
+        val_X: (NumPy) Normalized validation features.
+        formats: (list) Backends to export: 'tflite', 'tflite_int8', 'savedmodel', 'onnx'.
+        tolerance: (float) Maximum mean absolute prediction drift from the `h5` model.
+
+    Returns: The export report, also written to `export_report.json` in the model directory.
+    """
+    exporters = {
+        'tflite': lambda path: export_tflite(model, path),
+        'tflite_int8': lambda path: export_tflite(model, path, representative=val_X[:500]),
+        'savedmodel': lambda path: export_savedmodel(model, path),
+        'onnx': lambda path: export_onnx(model, path)
+    }
+
+    reference = runtimes.load_backend('keras', model_path)
+    expected = reference.predict(val_X.astype(np.float32)).flatten()
+    report = {'keras': {'size_mb': get_size_mb(os.path.join(model_path, runtimes.artifacts['keras'])),
+                        **benchmark(reference, val_X)}}
+
+    for name in formats:
+        if name not in exporters:
+            print("Skipping unknown export format: {}".format(name))
+            continue
+        path = os.path.join(model_path, runtimes.artifacts[name])
+        print("Exporting {} ...".format(name))
+        try:
+            exporters[name](path)
+
+            # Memory taken by loading the artifact, then accuracy drift and latency
+            rss = get_rss_mb()
+            start_time = time.perf_counter()
+            backend = runtimes.load_backend(name, model_path)
+            load_seconds = time.perf_counter() - start_time
+            load_rss_mb = get_rss_mb() - rss
+
+            drift = np.abs(backend.predict(val_X.astype(np.float32)).flatten() - expected)
+            report[name] = {
+                'size_mb': get_size_mb(path),
+                'load_seconds': load_seconds,
+                'load_rss_mb': load_rss_mb,
+                'mean_abs_drift': float(drift.mean()),
+                'max_abs_drift': float(drift.max()),
+                'passed': bool(drift.mean() <= tolerance),
+                **benchmark(backend, val_X)
+            }
+        except Exception as e:
+            # The h5 model is already saved, a failing export never fails the training job
+            print("Export of {} failed: {}".format(name, e))
+            report[name] = {'passed': False, 'error': str(e)}
+
+        # Don't ship an artifact a serving backend could pick up with drifting predictions
+        if not report[name]['passed']:
+            if 'error' not in report[name]:
+                print("Removing {} export: predictions drift from the h5 model by {:.4f} on average".format(
+                    name, report[name]['mean_abs_drift']))
+            remove(path)
+
+    with open(os.path.join(model_path, 'export_report.json'), 'w') as f:
+        json.dump(report, f, indent=4)
+    print("Export Report: {}".format(json.dumps(report)))
+    return report
@@ -0,0 +1,158 @@
+import os
+import json
+import numpy as np
+
+# Column names of the featurized dataset, the label `y_yes` comes first
+column_names = ['y_yes','age','campaign','pdays','previous','no_previous_contact',
+   'not_working','job_admin','job_blue-collar','job_entrepreneur',
+   'job_housemaid','job_management','job_retired','job_self-employed',
+   'job_services','job_student','job_technician','job_unemployed',
+   'job_unknown','marital_divorced','marital_married','marital_single',
+   'marital_unknown','education_basic', 'education_high school',
+   'education_illiterate','education_professional course',
+   'education_university degree','education_unknown','default_no','default_unknown',
+   'default_yes','housing_no','housing_unknown','housing_yes','loan_no','loan_unknown',
+   'loan_yes','contact_cellular','contact_telephone','month_apr','month_aug','month_dec',
+   'month_jul','month_jun','month_mar','month_may','month_nov','month_oct','month_sep',
+   'day_of_week_fri','day_of_week_mon','day_of_week_thu','day_of_week_tue',
+   'day_of_week_wed','poutcome_failure','poutcome_nonexistent','poutcome_success']
+
+# Model input features
+feature_names = column_names[1:]
+
+# Column names of the raw bankmarketing records (without the label)
+raw_column_names = ['age', 'job', 'marital', 'education', 'default', 'housing', 'loan',
+                    'contact', 'month', 'day_of_week', 'campaign', 'pdays', 'previous', 'poutcome']
+
+# Numeric raw columns passed through as is
+numeric_columns = ['age', 'campaign', 'pdays', 'previous']
+
+# Raw category values renamed by the ETL job before one-hot encoding
+category_mappings = {
+    'education': {'basic.4y': 'basic', 'basic.6y': 'basic', 'basic.9y': 'basic',
+                  'university.degree': 'university degree', 'high.school': 'high school',
+                  'professional.course': 'professional course'},
+    'job': {'admin.': 'admin'}
+}
+
+# Preprocessing specification exported with the model artifact
+spec_file = 'preprocessing.json'
+
+
+def normalize(X):
+    """ Scale each row to unit L2 norm in place, like `sklearn.preprocessing.normalize`.
+
+    Args:
+        X: (NumPy) Float feature matrix.
+
+    Returns: The normalized feature matrix.
+    """
+    norms = np.sqrt(np.einsum('ij,ij->i', X, X))
+    norms[norms == 0.0] = 1.0
+    X /= norms[:, np.newaxis]
+    return X
+
+
+def encode_raw(records):
+    """ Encode raw bankmarketing records into model features.
+
+    Mirrors `normalise_data` in the ETL job (etl/preprocess.py), vectorized over
+    the whole batch.
+
+    Args:
+        records: (NumPy) Array of raw records with the `raw_column_names` columns.
+
+    Returns: Float32 feature matrix with the `feature_names` columns.
+    """
+    records = np.asarray(records, dtype=object)
+    columns = {name: records[:, i] for i, name in enumerate(raw_column_names)}
+    X = np.zeros((len(records), len(feature_names)), dtype=np.float32)
+
+    for name in numeric_columns:
+        X[:, feature_names.index(name)] = columns[name].astype(np.float32)
+
+    # Categories as strings, renamed like the ETL job
+    categories = {}
+    for name in raw_column_names:
+        if name in numeric_columns:
+            continue
+        values = columns[name].astype(str).astype(object)
+        for old, new in category_mappings.get(name, {}).items():
+            values[values == old] = new
+        categories[name] = values
+
+    # Indicator variables derived by the ETL job
+    X[:, feature_names.index('no_previous_contact')] = X[:, feature_names.index('pdays')] == 999
+    X[:, feature_names.index('not_working')] = np.isin(categories['job'], ['student', 'retired', 'unemployed'])
+
+    # One-hot encode the categorical columns
+    for i, feature in enumerate(feature_names):
+        for name, values in categories.items():
+            if feature.startswith(name + '_'):
+                X[:, i] = values == feature[len(name) + 1:]
+                break
+
+    return X
+
+
+def save_spec(path):
+    """ Export the preprocessing applied during training with the model artifact.
+
+    Args:
+        path: (str) Model directory.
+    """
+    spec = {
+        'normalize': 'l2',
+        'feature_names': feature_names,
+        'raw_column_names': raw_column_names
+    }
+    with open(os.path.join(path, spec_file), 'w') as f:
+        json.dump(spec, f, indent=4)
+
+
+class Preprocessor(object):
+    """ Serving-side preprocessing of request batches.
+
+    Accepts either featurized rows (57 columns) or raw records (14 columns).
+    Models exported without a preprocessing specification get the rows as is.
+    """
+    def __init__(self, spec=None):
+        self.spec = spec
+
+    @classmethod
+    def load(cls, path):
+        """ Load the preprocessing specification exported with a model.
+
+        Args:
+            path: (str) Model directory.
+
+        Returns: A Preprocessor for the model.
+        """
+        spec_path = os.path.join(path, spec_file)
+        if not os.path.exists(spec_path):
+            return cls()
+        with open(spec_path, 'r') as f:
+            return cls(json.load(f))
+
+    def transform(self, rows):
+        """ Transform a batch of rows into model input.
+
+        Args:
+            rows: (NumPy) 2D array of featurized rows or raw records.
+
+        Returns: Float32 model input.
+        """
+        if self.spec is None:
+            return np.asarray(rows, dtype=np.float32)
+
+        if rows.shape[1] == len(self.spec['raw_column_names']):
+            X = encode_raw(rows)
+        elif rows.shape[1] == len(self.spec['feature_names']):
+            X = np.array(rows, dtype=np.float32)
+        else:
+            raise ValueError("Expected {} feature or {} raw columns, got {}".format(
+                len(self.spec['feature_names']), len(self.spec['raw_column_names']), rows.shape[1]))
+
+        if self.spec.get('normalize') == 'l2':
+            normalize(X)
+        return X
@@ -0,0 +1,87 @@
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+
+# Directory holding `model.py`
+program_path = os.path.dirname(os.path.abspath(__file__))
+
+
+def get_free_port():
+    """ Reserve a free TCP port on the local machine.
+
+    Returns: Port number.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+def set_hyperparameters(prefix, **params):
+    """ Add the given hyperparameters to the local training job configuration.
+
+    Args:
+        prefix: (str) Local replacement for the '/opt/ml' directory.
+        params: Hyperparameters to set, values are stored as strings like SageMaker does.
+    """
+    param_path = os.path.join(prefix, 'input/config/hyperparameters.json')
+    with open(param_path, 'r') as f:
+        hyperparameters = json.load(f)
+    hyperparameters.update({key: str(value) for key, value in params.items()})
+    with open(param_path, 'w') as f:
+        json.dump(hyperparameters, f, indent=4)
+
+
+def run_cluster(prefix, workers):
+    """ Launch one training process per worker with a generated `TF_CONFIG`.
+
+    Args:
+        prefix: (str) Local replacement for the '/opt/ml' directory.
+        workers: (int) Number of worker processes.
+
+    Returns: The scaling report written by the chief worker.
+    """
+    # Start from scratch rather than resuming a previous run
+    shutil.rmtree(os.path.join(prefix, 'checkpoints'), ignore_errors=True)
+
+    cluster = {'worker': ['localhost:{}'.format(get_free_port()) for _ in range(workers)]}
+    processes = []
+    for index in range(workers):
+        env = dict(os.environ)
+        env['SM_PREFIX'] = prefix
+        env['TF_CONFIG'] = json.dumps({'cluster': cluster, 'task': {'type': 'worker', 'index': index}})
+        processes.append(subprocess.Popen(
+            [sys.executable, '-c', 'import model; model.train()'],
+            cwd=program_path,
+            env=env
+        ))
+
+    # Fail the run if any worker failed
+    for process in processes:
+        if process.wait() != 0:
+            raise Exception("Worker process exited with code {}".format(process.returncode))
+
+    with open(os.path.join(prefix, 'output/data/scaling.json'), 'r') as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prefix", type=str, default=os.environ.get("SM_PREFIX", "/opt/ml"))
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--baseline", action="store_true", help="Run a single worker first to measure scaling efficiency")
+    args, _ = parser.parse_known_args()
+
+    set_hyperparameters(args.prefix, distributed='true')
+
+    if args.baseline:
+        print("Running single worker baseline ...")
+        baseline = run_cluster(args.prefix, 1)
+        set_hyperparameters(args.prefix, baseline_throughput='{:.4f}'.format(baseline['worker_samples_per_second']))
+
+    print("Running {} workers ...".format(args.workers))
+    report = run_cluster(args.prefix, args.workers)
+    print(json.dumps(report, indent=4))
@@ -0,0 +1,170 @@
+import os
+import time
+import collections
+import numpy as np
+from capture import get_original
+
+# CloudWatch namespace of the load metrics, publishing is disabled when unset
+namespace = os.environ.get('METRICS_NAMESPACE')
+
+# Seconds between two publications, also the window of the latency percentiles
+interval = float(os.environ.get('METRICS_INTERVAL', 60))
+
+# Latencies kept per window, older ones are dropped under very high load
+window_size = 10000
+
+# Weight of the last request in the moving average latency
+latency_smoothing = 0.1
+
+
+class LoadTracker(object):
+    """ Saturation of a worker, measured on the request path.
+
+    In-flight requests are integrated over time, so `utilization` is the
+    fraction of the window the worker had at least one request in progress
+    and `in_flight` the average number of concurrent requests, whatever the
+    request count or batch size. Queue wait is the time between nginx
+    accepting the request and the worker starting it.
+    """
+    def __init__(self):
+        self.lock = get_original('threading', 'Lock')()
+        self.current = 0
+        self.mean_latency_ms = 0.0
+        self.reset(time.monotonic())
+
+    def reset(self, now):
+        self.window_start = now
+        self.updated = now
+        self.busy_seconds = 0.0
+        self.in_flight_seconds = 0.0
+        self.invocations = 0
+        self.rows = 0
+        self.rejected = 0
+        self.expired = 0
+        self.latencies = collections.deque(maxlen=window_size)
+        self.queue_waits = collections.deque(maxlen=window_size)
+
+    def advance(self, now):
+        elapsed = now - self.updated
+        self.in_flight_seconds += self.current * elapsed
+        if self.current > 0:
+            self.busy_seconds += elapsed
+        self.updated = now
+
+    def start(self, queue_wait_ms=None):
+        with self.lock:
+            self.advance(time.monotonic())
+            self.current += 1
+            if queue_wait_ms is not None:
+                self.queue_waits.append(queue_wait_ms)
+
+    def finish(self, latency_ms, rows=0):
+        with self.lock:
+            self.advance(time.monotonic())
+            self.current -= 1
+            self.invocations += 1
+            self.rows += rows
+            self.latencies.append(latency_ms)
+            self.mean_latency_ms += latency_smoothing * (latency_ms - self.mean_latency_ms)
+
+    def reject(self, reason):
+        """ Count a request turned away by the admission control, see `admission.py`.
+        """
+        with self.lock:
+            if reason == 'expired':
+                self.expired += 1
+            else:
+                self.rejected += 1
+
+    def collect(self):
+        """ Metrics of the window since the last call, then start a new window.
+
+        Returns: A dictionary of metric name to value.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.advance(now)
+            seconds = max(now - self.window_start, 1e-6)
+            latencies, queue_waits = list(self.latencies), list(self.queue_waits)
+            metrics = {
+                'Utilization': self.busy_seconds / seconds,
+                'InFlightRequests': self.in_flight_seconds / seconds,
+                'Invocations': self.invocations,
+                'RowsPerSecond': self.rows / seconds,
+                'Rejected': self.rejected,
+                'Expired': self.expired
+            }
+            self.reset(now)
+        metrics['LatencyP90Ms'] = float(np.percentile(latencies, 90)) if latencies else 0.0
+        metrics['QueueWaitP90Ms'] = float(np.percentile(queue_waits, 90)) if queue_waits else 0.0
+        return metrics
+
+
+def get_queue_wait_ms(header):
+    """ Time spent queued since nginx accepted the request.
+
+    Args:
+        header: (str) `X-Request-Start` header set by nginx, `t=<epoch seconds>`.
+
+    Returns: The queue wait in milliseconds, None without a valid header.
+    """
+    try:
+        return max(0.0, (time.time() - float(header.split('=')[-1])) * 1000)
+    except (AttributeError, ValueError):
+        return None
+
+
+class MetricsPublisher(object):
+    """ Publish the load metrics of a worker to CloudWatch from a background thread.
+
+    Every worker publishes its own values under the endpoint and variant
+    dimensions, so the `Average` statistic is the load of an average worker
+    across the instances of the variant.
+    """
+    units = {
+        'Utilization': 'None',
+        'InFlightRequests': 'Count',
+        'Invocations': 'Count',
+        'RowsPerSecond': 'Count/Second',
+        'Rejected': 'Count',
+        'Expired': 'Count',
+        'LatencyP90Ms': 'Milliseconds',
+        'QueueWaitP90Ms': 'Milliseconds'
+    }
+
+    def __init__(self, tracker, namespace):
+        import boto3
+        self.tracker = tracker
+        self.namespace = namespace
+        self.dimensions = [
+            {'Name': 'EndpointName', 'Value': os.environ.get('ENDPOINT_NAME', 'local')},
+            {'Name': 'VariantName', 'Value': os.environ.get('VARIANT_NAME', 'AllTraffic')}
+        ]
+        self.cloudwatch = boto3.client('cloudwatch')
+        self.sleep = get_original('time', 'sleep')
+        self.thread = None
+
+    def start(self):
+        """ Start the publishing thread, once per worker process.
+        """
+        if self.thread is None:
+            self.thread = get_original('threading', 'Thread')(target=self.run, daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            self.sleep(interval)
+            metrics = self.tracker.collect()
+            try:
+                self.cloudwatch.put_metric_data(Namespace=self.namespace, MetricData=[
+                    {'MetricName': name, 'Dimensions': self.dimensions,
+                     'Value': value, 'Unit': self.units[name]}
+                    for name, value in metrics.items()
+                ])
+            except Exception as e:
+                print("Failed to publish load metrics: {}".format(e))
+
+
+# Load tracker and publisher of this worker process
+tracker = LoadTracker()
+publisher = MetricsPublisher(tracker, namespace) if namespace else None
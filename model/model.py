@@ -2,20 +2,27 @@ import os
 import sys
 import json
 import re
+import ast
+import time
+import glob
+import math
+import inspect
+import tempfile
+import tarfile
+import shutil
+import resource
+import csv
+import hashlib
 import traceback
 import numpy as np
-import pandas as pd
 import tensorflow as tf
 from tensorflow import keras
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import Dense
-from tensorflow.keras.optimizers import Adam
-from sklearn import preprocessing
+import features
 
 tf.get_logger().setLevel('ERROR')
 
-# Path prefix for Sagemaker to identify files in container
-prefix = '/opt/ml'
+# Path prefix for Sagemaker to identify files in container (overridable for local runs)
+prefix = os.environ.get('SM_PREFIX', '/opt/ml')
 
 # Path for data storage in Sagemaker
 input_path = os.path.join(prefix, 'input/data')
@@ -26,9 +33,539 @@ output_path = os.path.join(prefix, 'output')
 # Create a model.tar.gz file 
 model_path = os.path.join(prefix, 'model')
 
+# Parsed and normalized copies of the dataset splits, reused by repeat runs
+cache_path = os.path.join(prefix, 'cache')
+
+# Checkpoints synced to S3 by SageMaker, restored when a (spot) training job restarts
+checkpoint_path = os.path.join(prefix, 'checkpoints')
+
+# Files of the incremental training mode consumed so far, written with the model
+manifest_file = 'training_manifest.json'
+
 # Hyperparameters to be sent to training job estimator
 param_path = os.path.join(prefix, 'input/config/hyperparameters.json')
 
+# Cluster layout of the training job (hosts and current host)
+resource_path = os.path.join(prefix, 'input/config/resourceconfig.json')
+
+# Channel configuration of the training job (distribution type per channel)
+channel_path = os.path.join(prefix, 'input/config/inputdataconfig.json')
+
+# Hyperparameters set by the `profile` hyperparameter, these override the job hyperparameters
+profiles = {
+    # Fewer, larger steps: amortizes the per-step overhead that dominates with `batch_size` 8
+    'performance': {
+        'batch_size': 256,
+        'xla': 'true',
+        'steps_per_execution': 32,
+        'warmup_epochs': 5
+    }
+}
+
+# Batch size the default learning rate was tuned for
+base_batch_size = 8
+
+# Batches read from the input pipeline alone before training, see `PerformanceMonitor`
+performance_probe_steps = 50
+
+
+def load_params():
+    """ Read in any hyperparameters that are passed with the training job.
+
+    Returns: A dictionary of hyperparameters with numeric values converted from strings.
+    """
+    params = {}
+    with open(param_path, 'r') as tc:
+        is_float = re.compile(r'^\d+(?:\.\d+)$')
+        is_integer = re.compile(r'^\d+$')
+        for key, value in json.load(tc).items():
+
+            # Check and convert values from string
+            if is_float.match(value) is not None:
+                value = float(value)
+            elif is_integer.match(value) is not None:
+                value = int(value)
+            params[key] = value
+
+    return params
+
+
+def is_enabled(params, name):
+    """ Check whether a boolean hyperparameter is switched on.
+
+    Args:
+        params: (dict) Parsed hyperparameters.
+        name: (str) Name of the hyperparameter.
+
+    Returns: True if the hyperparameter is set to 'true'.
+    """
+    return str(params.get(name, 'false')).lower() == 'true'
+
+
+def apply_profile(params):
+    """ Apply the training profile selected with the `profile` hyperparameter.
+
+    Args:
+        params: (dict) Parsed hyperparameters.
+
+    Returns: Hyperparameters with the profile settings applied.
+    """
+    profile = params.get('profile')
+    if profile is None:
+        return params
+    if profile not in profiles:
+        raise ValueError("Unknown training profile: {}".format(profile))
+    print("Training profile: {}".format(profile))
+    return {**params, **profiles[profile]}
+
+
+def configure_cluster(params):
+    """ Configure `TF_CONFIG` for multi-worker training.
+
+    An existing `TF_CONFIG` (e.g. generated by `local_cluster.py`) is used as is,
+    otherwise it is built from the SageMaker resource configuration.
+
+    Args:
+        params: (dict) Parsed hyperparameters.
+
+    Returns: A tuple of the number of workers and the index of the current worker.
+    """
+    if 'TF_CONFIG' not in os.environ:
+        with open(resource_path, 'r') as rc:
+            resources = json.load(rc)
+        hosts = sorted(resources['hosts'])
+        port = params.get('worker_port', 12345)
+        os.environ['TF_CONFIG'] = json.dumps({
+            'cluster': {'worker': ['{}:{}'.format(host, port) for host in hosts]},
+            'task': {'type': 'worker', 'index': hosts.index(resources['current_host'])}
+        })
+
+    tf_config = json.loads(os.environ['TF_CONFIG'])
+    return len(tf_config['cluster']['worker']), tf_config['task']['index']
+
+
+def get_distribution_type(channel_name):
+    """ Get the S3 data distribution type of an input channel.
+
+    Args:
+        channel_name: (str) Name of the input channel.
+
+    Returns: 'FullyReplicated' or 'ShardedByS3Key'.
+    """
+    if not os.path.exists(channel_path):
+        return 'FullyReplicated'
+    with open(channel_path, 'r') as ic:
+        channels = json.load(ic)
+    return channels.get(channel_name, {}).get('S3DistributionType', 'FullyReplicated')
+
+
+def count_rows(file):
+    """ Count the rows of a CSV file without parsing it.
+
+    Args:
+        file: (str) CSV file path.
+
+    Returns: Number of rows.
+    """
+    rows = 0
+    last = b'\n'
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            rows += block.count(b'\n')
+            last = block[-1:]
+    # Count a last row without a trailing newline
+    return rows + (last != b'\n')
+
+
+def load_split(path, split, files=None):
+    """ Load every file of a dataset split into float32 features and labels.
+
+    Rows are parsed in chunks straight into preallocated arrays and the features
+    are normalized in place. The result is cached as `.npy` files, memory-mapped
+    instead of parsed on repeat runs over the same files.
+
+    With `ShardedByS3Key` each worker only receives a subset of the split files.
+
+    Args:
+        path: (str) Channel directory.
+        split: (str) Split file prefix, i.e. 'train' or 'validate'.
+        files: (list) Files to load instead of the split files of the channel.
+
+    Returns: A tuple of the normalized feature matrix and the label vector.
+    """
+    if files is None:
+        files = sorted(glob.glob(os.path.join(path, '{}*.csv'.format(split))))
+    if len(files) == 0:
+        raise ValueError("No '{}' files found in {}".format(split, path))
+
+    # Cache key of the split files, a change to any file invalidates the cache
+    key = hashlib.sha1(json.dumps(
+        [(file, os.path.getsize(file), os.path.getmtime(file)) for file in files]
+    ).encode('utf-8')).hexdigest()
+    X_cache = os.path.join(cache_path, '{}-{}-X.npy'.format(split, key))
+    y_cache = os.path.join(cache_path, '{}-{}-y.npy'.format(split, key))
+    if os.path.exists(X_cache) and os.path.exists(y_cache):
+        print("Memory-mapping cached '{}' split".format(split))
+        return np.load(X_cache, mmap_mode='r'), np.load(y_cache, mmap_mode='r')
+
+    rows = sum(count_rows(file) for file in files)
+    X = np.empty((rows, len(features.feature_names)), dtype=np.float32)
+    y = np.empty(rows, dtype=np.float32)
+
+    # Parse a bounded chunk at a time with explicit dtypes, the label comes first
+    import pandas as pd
+    offset = 0
+    for file in files:
+        for chunk in pd.read_csv(file, sep=',', header=None, dtype=np.float32, chunksize=65536):
+            if chunk.shape[1] != len(features.column_names):
+                raise ValueError("Expected {} columns in {}, found {}".format(
+                    len(features.column_names), file, chunk.shape[1]))
+            block = chunk.to_numpy()
+            X[offset:offset + len(block)] = block[:, 1:]
+            y[offset:offset + len(block)] = block[:, 0]
+            offset += len(block)
+    X, y = X[:offset], y[:offset]
+
+    # Normalize the data
+    features.normalize(X)
+
+    # Write the cache atomically so an interrupted run can't leave a partial file
+    os.makedirs(cache_path, exist_ok=True)
+    for cache, array in [(X_cache, X), (y_cache, y)]:
+        with open(cache + '.tmp', 'wb') as f:
+            np.save(f, array)
+        os.replace(cache + '.tmp', cache)
+
+    return X, y
+
+
+def load_manifest(path):
+    """ Load the manifest of an incremental training run.
+
+    Args:
+        path: (str) Model directory.
+
+    Returns: The manifest, empty if the model was not trained incrementally.
+    """
+    manifest_path = os.path.join(path, manifest_file)
+    if not os.path.exists(manifest_path):
+        return {'consumed': {}, 'runs': []}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def get_base_model_path(path):
+    """ Find the model to warm-start from in the `model` channel.
+
+    Args:
+        path: (str) Channel directory, holding `model.h5` or the `model.tar.gz`
+            of the production training job.
+
+    Returns: The directory holding `model.h5` and its manifest.
+    """
+    if not os.path.exists(os.path.join(path, 'model.h5')):
+        archive = os.path.join(path, 'model.tar.gz')
+        if not os.path.exists(archive):
+            raise ValueError("No model.h5 or model.tar.gz found in {}".format(path))
+        path = tempfile.mkdtemp()
+        with tarfile.open(archive, 'r:gz') as tar:
+            tar.extractall(path)
+    return path
+
+
+def copy_model(source, destination):
+    """ Copy the artifacts of a model directory into an existing directory.
+
+    `shutil.copytree` only accepts an existing destination from Python 3.8,
+    the training image runs Python 3.7.
+    """
+    for root, _, names in os.walk(source):
+        target = os.path.join(destination, os.path.relpath(root, source))
+        os.makedirs(target, exist_ok=True)
+        for name in names:
+            shutil.copy2(os.path.join(root, name), os.path.join(target, name))
+
+
+def load_incremental(training_path, manifest, params):
+    """ Load the rows labeled since the last run mixed with a replay sample of
+    the historical training rows.
+
+    New files of the `incremental` channel, e.g. captured requests joined with
+    their labels in the `train` format, are told apart from consumed ones by
+    name and size, files are expected to be written once.
+
+    Args:
+        training_path: (str) Channel directory of the historical `train` split.
+        manifest: (dict) Manifest of the warm-start model, updated with the new files.
+        params: (dict) Parsed hyperparameters.
+
+    Returns: A tuple of the feature matrix and the label vector, None if there is no new data.
+    """
+    incremental_path = os.path.join(input_path, 'incremental')
+    files = sorted(glob.glob(os.path.join(incremental_path, '**', '*.csv'), recursive=True))
+    new_files = [file for file in files
+                 if manifest['consumed'].get(os.path.relpath(file, incremental_path)) != os.path.getsize(file)]
+    print("Incremental training: {} new of {} files".format(len(new_files), len(files)))
+    if len(new_files) == 0:
+        return None
+
+    new_X, new_y = load_split(incremental_path, 'incremental', files=new_files)
+
+    # Replay historical rows so the model doesn't drift to the new data only
+    train_X, train_y = load_split(training_path, 'train')
+    replay_rows = min(len(train_X), int(len(new_X) * params.get('replay_ratio', 1.0)))
+    # Seeded by the run number, every worker of a distributed run draws the same rows
+    replay = np.sort(np.random.default_rng(len(manifest['runs'])).choice(len(train_X), replay_rows, replace=False))
+    print("Training on {} new and {} replayed rows".format(len(new_X), replay_rows))
+
+    for file in new_files:
+        manifest['consumed'][os.path.relpath(file, incremental_path)] = os.path.getsize(file)
+    manifest['runs'].append({'time': time.time(), 'files': len(new_files),
+                             'new_rows': len(new_X), 'replay_rows': replay_rows})
+    return np.concatenate([new_X, train_X[replay]]), np.concatenate([new_y, train_y[replay]])
+
+
+class WarmupSchedule(keras.optimizers.schedules.LearningRateSchedule):
+    """ Linear learning rate warmup to a constant target learning rate.
+
+    Large batches take large steps from the start, ramping up the learning rate
+    keeps the first epochs from diverging.
+    """
+    def __init__(self, learning_rate, warmup_steps):
+        super(WarmupSchedule, self).__init__()
+        self.learning_rate = learning_rate
+        self.warmup_steps = warmup_steps
+
+    def __call__(self, step):
+        step = tf.cast(step + 1, tf.float32)
+        return self.learning_rate * tf.minimum(1.0, step / self.warmup_steps)
+
+    def get_config(self):
+        return {'learning_rate': self.learning_rate, 'warmup_steps': self.warmup_steps}
+
+
+class TargetLossStop(keras.callbacks.Callback):
+    """ Record the time taken to reach a target `val_loss` and stop training there.
+    """
+    def __init__(self, target=None):
+        super(TargetLossStop, self).__init__()
+        self.target = target
+        self.time_to_target = None
+
+    def on_train_begin(self, logs=None):
+        self.start_time = time.time()
+
+    def on_epoch_end(self, epoch, logs=None):
+        if self.target is None or self.time_to_target is not None:
+            return
+        if logs.get('val_loss') is not None and logs['val_loss'] <= self.target:
+            self.time_to_target = time.time() - self.start_time
+            self.model.stop_training = True
+
+
+class CheckpointSaver(keras.callbacks.Callback):
+    """ Periodically checkpoint the weights, optimizer state and epoch counter.
+    """
+    def __init__(self, manager, epoch, every=1):
+        super(CheckpointSaver, self).__init__()
+        self.manager = manager
+        self.epoch = epoch
+        self.every = every
+
+    def on_epoch_end(self, epoch, logs=None):
+        if (epoch + 1) % self.every == 0:
+            self.epoch.assign(epoch + 1)
+            path = self.manager.save(checkpoint_number=epoch + 1)
+            print("Saved checkpoint: {}".format(path))
+
+
+class PerformanceMonitor(keras.callbacks.Callback):
+    """ Record per-epoch training throughput, step times and resource usage.
+
+    Step time is measured around the train step, which also fetches the next
+    batch, so input pipeline stalls are part of it. Time between steps is spent
+    on the host outside the train step (Python overhead and callbacks). The
+    input pipeline is timed on its own before training instead, a probe step
+    time close to the step time points to an input bound job.
+    """
+    def __init__(self, samples_per_epoch, probe_dataset=None, probe_steps=performance_probe_steps, trace_steps=None, trace_path=None):
+        super(PerformanceMonitor, self).__init__()
+        self.samples_per_epoch = samples_per_epoch
+        self.probe_dataset = probe_dataset
+        self.probe_steps = probe_steps
+        self.trace_steps = trace_steps
+        self.trace_path = trace_path
+        self.input_step_seconds = None
+        self.global_step = 0
+        self.epochs = []
+
+    def on_train_begin(self, logs=None):
+        if self.probe_dataset is not None:
+            steps = 0
+            start_time = time.perf_counter()
+            for _ in self.probe_dataset.take(self.probe_steps):
+                steps += 1
+            self.input_step_seconds = (time.perf_counter() - start_time) / max(steps, 1)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.step_times = []
+        self.between_steps_time = 0.0
+        self.batch_end = None
+        self.epoch_start = time.perf_counter()
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.batch_start = time.perf_counter()
+        if self.batch_end is not None:
+            self.between_steps_time += self.batch_start - self.batch_end
+
+        # Capture a TF profiler trace over the chosen step range
+        if self.trace_steps is not None and self.global_step == self.trace_steps[0]:
+            tf.profiler.experimental.start(self.trace_path)
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.batch_end = time.perf_counter()
+        self.step_times.append(self.batch_end - self.batch_start)
+
+        if self.trace_steps is not None and self.global_step == self.trace_steps[1]:
+            tf.profiler.experimental.stop()
+        self.global_step += 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        duration = time.perf_counter() - self.epoch_start
+        step_times = np.array(self.step_times)
+        self.epochs.append({
+            'epoch': epoch + 1,
+            'duration_seconds': duration,
+            'samples_per_second': self.samples_per_epoch / duration,
+            'steps': len(step_times),
+            'step_p50_seconds': float(np.percentile(step_times, 50)),
+            'step_p90_seconds': float(np.percentile(step_times, 90)),
+            'step_p99_seconds': float(np.percentile(step_times, 99)),
+            'step_seconds': float(step_times.sum()),
+            'between_steps_seconds': self.between_steps_time,
+            'input_probe_step_seconds': self.input_step_seconds,
+            # `ru_maxrss` is reported in kilobytes on Linux
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        })
+
+    def on_train_end(self, logs=None):
+        # Stop a trace still running when training ended inside the step range
+        if self.trace_steps is not None and self.trace_steps[0] < self.global_step <= self.trace_steps[1]:
+            tf.profiler.experimental.stop()
+
+    def write_report(self, path):
+        """ Write the per-epoch telemetry as JSON and CSV files.
+
+        Args:
+            path: (str) Output directory.
+        """
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'telemetry.json'), 'w') as f:
+            json.dump(self.epochs, f, indent=4)
+        if len(self.epochs) > 0:
+            with open(os.path.join(path, 'telemetry.csv'), 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=list(self.epochs[0].keys()))
+                writer.writeheader()
+                writer.writerows(self.epochs)
+
+
+def restore_checkpoint(model, optimizer, epoch, worker_index):
+    """ Restore the latest checkpoint, if any, and return the checkpoint manager.
+
+    Every worker restores from the checkpoint directory, non-chief workers take
+    part in saving (required by the collective ops of multi-worker training)
+    but write to a temporary directory.
+
+    Args:
+        model: (Model) Compiled Keras model.
+        optimizer: (Optimizer) Optimizer of the model.
+        epoch: (Variable) Epoch counter saved with the checkpoint.
+        worker_index: (int) Index of the current worker.
+
+    Returns: The checkpoint manager.
+    """
+    checkpoint = tf.train.Checkpoint(model=model, optimizer=optimizer, epoch=epoch)
+    latest_checkpoint = tf.train.latest_checkpoint(checkpoint_path)
+    if latest_checkpoint is not None:
+        checkpoint.restore(latest_checkpoint)
+        print("Resuming from checkpoint {} at epoch {}".format(latest_checkpoint, int(epoch.numpy())))
+
+    directory = checkpoint_path if worker_index == 0 else tempfile.mkdtemp()
+    return tf.train.CheckpointManager(checkpoint, directory, max_to_keep=2)
+
+
+def get_learning_rate(params, batch_size, steps_per_epoch):
+    """ Scale the learning rate to the batch size with an optional warmup.
+
+    Square-root scaling is used as it suits Adam better than linear scaling.
+
+    Args:
+        params: (dict) Parsed hyperparameters.
+        batch_size: (int) Global batch size.
+        steps_per_epoch: (int) Number of training steps per epoch.
+
+    Returns: A learning rate or a learning rate schedule for the optimizer.
+    """
+    learning_rate = params.get('learning_rate', 0.001) * math.sqrt(batch_size / base_batch_size)
+    warmup_steps = params.get('warmup_epochs', 0) * steps_per_epoch
+    if warmup_steps > 0:
+        return WarmupSchedule(learning_rate, warmup_steps)
+    return learning_rate
+
+
+def set_precision(params):
+    """ Set the global Keras precision policy.
+
+    Args:
+        params: (dict) Parsed hyperparameters, `mixed_precision` enables 'mixed_bfloat16'.
+    """
+    policy = 'mixed_bfloat16' if is_enabled(params, 'mixed_precision') else 'float32'
+    if hasattr(tf.keras.mixed_precision, 'set_global_policy'):
+        tf.keras.mixed_precision.set_global_policy(policy)
+    else:
+        tf.keras.mixed_precision.experimental.set_policy(policy)
+
+
+def build_model(params):
+    """ Build the DNN regression model.
+
+    Args:
+        params: (dict) Parsed hyperparameters.
+
+    Returns: Uncompiled Keras model.
+    """
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import Dense
+
+    # Initialize weight tensors with a normal "Xavier" distribution
+    initializer = tf.keras.initializers.GlorotNormal()
+    dense_layers = []
+
+    # Build Deep layers
+    for layer in range(int(params.get('layers'))):
+        if layer == 0:
+            dense_layers.append(Dense(params.get('dense_layer'), kernel_initializer=initializer, input_dim=57))
+        else:
+            dense_layers.append(Dense(params.get('dense_layer'), activation='relu'))
+
+    # Add final linear `pass-through` layer, kept in float32 for a numerically stable loss
+    dense_layers.append(Dense(1, activation='linear', dtype='float32'))
+
+    return Sequential(dense_layers)
+
+
+def write_scaling_report(report):
+    """ Write the scaling report of a training run to the job output.
+
+    Args:
+        report: (dict) Throughput and scaling metrics of the run.
+    """
+    report_path = os.path.join(output_path, 'data')
+    os.makedirs(report_path, exist_ok=True)
+    with open(os.path.join(report_path, 'scaling.json'), 'w') as f:
+        json.dump(report, f, indent=4)
+    print("Scaling Report: {}".format(json.dumps(report)))
+
 
 # Model training function
 def train():
@@ -39,19 +576,18 @@ def train():
         channel_name = 'training'
         training_path = os.path.join(input_path, channel_name)
 
-        params = {}
         # Read in any hyperparameters that the are passed with the training job
-        with open(param_path, 'r') as tc:
-            is_float = re.compile(r'^\d+(?:\.\d+)$')
-            is_integer = re.compile(r'^\d+$')
-            for key, value in json.load(tc).items():
-
-                # Check and convert values from string
-                if is_float.match(value) is not None:
-                    value = float(value)
-                elif is_integer.match(value) is not None:
-                    value = int(value)
-                params[key] = value
+        params = apply_profile(load_params())
+
+        # Opt-in multi-worker training, the strategy must be created before any other TF op
+        distributed = is_enabled(params, 'distributed')
+        num_workers, worker_index = 1, 0
+        if distributed:
+            num_workers, worker_index = configure_cluster(params)
+            strategy = tf.distribute.experimental.MultiWorkerMirroredStrategy()
+            print("Distributed training: worker {} of {}".format(worker_index, num_workers))
+        else:
+            strategy = tf.distribute.get_strategy()
 
         # Check if input files are present at the specified location
         input_files = [ os.path.join(training_path, file) for file in os.listdir(training_path) ]
@@ -62,37 +598,30 @@ def train():
                               'does not have permission to access the data.').format(training_path, 
                                                                                      channel_name))
         
-        # Column names for the dataset in use
-        column_names = ['y_yes','age','campaign','pdays','previous','no_previous_contact',
-           'not_working','job_admin','job_blue-collar','job_entrepreneur',
-           'job_housemaid','job_management','job_retired','job_self-employed',
-           'job_services','job_student','job_technician','job_unemployed',
-           'job_unknown','marital_divorced','marital_married','marital_single',
-           'marital_unknown','education_basic', 'education_high school',
-           'education_illiterate','education_professional course',
-           'education_university degree','education_unknown','default_no','default_unknown',
-           'default_yes','housing_no','housing_unknown','housing_yes','loan_no','loan_unknown',
-           'loan_yes','contact_cellular','contact_telephone','month_apr','month_aug','month_dec',
-           'month_jul','month_jun','month_mar','month_may','month_nov','month_oct','month_sep',
-           'day_of_week_fri','day_of_week_mon','day_of_week_thu','day_of_week_tue',
-           'day_of_week_wed','poutcome_failure','poutcome_nonexistent','poutcome_success']
-        
-        # Load the training dataset
-        train_data = pd.read_csv(os.path.join(training_path, 'train.csv'), sep=',', names=column_names)
+        # Warm-start from the production model and fine-tune on the data labeled since its training
+        incremental = is_enabled(params, 'incremental')
+        if incremental:
+            base_model_path = get_base_model_path(os.path.join(input_path, 'model'))
+            manifest = load_manifest(base_model_path)
+            loaded = load_incremental(training_path, manifest, params)
+            if loaded is None:
+                # Nothing new to learn, ship the production model unchanged
+                if worker_index == 0:
+                    copy_model(base_model_path, model_path)
+                return
+            train_X, train_y = loaded
+            params = {**params,
+                      'epochs': params.get('incremental_epochs', 20),
+                      'learning_rate': params.get('incremental_learning_rate', params.get('learning_rate', 0.001) / 10)}
+        else:
+            # Load the training dataset
+            train_X, train_y = load_split(training_path, 'train')
         
-        # Load the validation dataset
-        val_data = pd.read_csv(os.path.join(training_path, 'validate.csv'), sep=',', names=column_names)
-
-        # Split the data for training features and prediction column
-        train_y = train_data['y_yes'].to_numpy()
-        train_X = train_data.drop(['y_yes'], axis=1).to_numpy()
-
-        val_y = val_data['y_yes'].to_numpy()
-        val_X = val_data.drop(['y_yes'], axis=1).to_numpy()
-
-        # Normalize the data
-        train_X = preprocessing.normalize(train_X)
-        val_X = preprocessing.normalize(val_X)
+        # Load the validation dataset, from its own channel when the training channel is sharded
+        validation_path = os.path.join(input_path, 'validation')
+        if not os.path.isdir(validation_path):
+            validation_path = training_path
+        val_X, val_y = load_split(validation_path, 'validate')
         
         # Configure early stopping to save model from overfitting
         early_stop = keras.callbacks.EarlyStopping(monitor='val_loss', min_delta=0.01, patience=10)
@@ -101,37 +630,118 @@ def train():
         algorithm = 'TensorflowRegression'
         print("Training Algorithm: %s" % algorithm)
 
-        # Initialize weight tensors with a normal "Xavier" distribution
-        initializer = tf.keras.initializers.GlorotNormal()
-        dense_layers = []
+        # Scale the batch with the number of workers so each worker keeps `batch_size`
+        batch_size = params.get('batch_size') * num_workers
+        steps_per_epoch = math.ceil(len(train_X) / batch_size)
+
+        # Compile clusters of ops in the train step with XLA
+        if is_enabled(params, 'xla'):
+            tf.config.optimizer.set_jit(True)
+        set_precision(params)
 
-        # Build Deep layers
-        for layer in range(int(params.get('layers'))):
-            if layer == 0:
-                dense_layers.append(Dense(params.get('dense_layer'), kernel_initializer=initializer, input_dim=57))
+        with strategy.scope():
+            # Build the model, or load the production model in the incremental mode
+            if incremental:
+                model = keras.models.load_model(os.path.join(base_model_path, 'model.h5'), compile=False)
             else:
-                dense_layers.append(Dense(params.get('dense_layer'), activation='relu'))
+                model = build_model(params)
+            model.summary()
 
-        # Add final linear `pass-through` layer
-        dense_layers.append(Dense(1, activation='linear'))
+            # `steps_per_execution` left experimental until TF 2.4
+            compile_args = {}
+            steps_per_execution = params.get('steps_per_execution', 1)
+            if 'steps_per_execution' in inspect.signature(model.compile).parameters:
+                compile_args['steps_per_execution'] = steps_per_execution
+            else:
+                compile_args['experimental_steps_per_execution'] = steps_per_execution
 
-        # Build the model
-        model = Sequential(dense_layers)
-        model.summary()
-        
-        # Compile and train the model
-        model.compile(loss='mse', optimizer='adam', metrics=['mae','accuracy'])
-        model.fit(
-            train_X,
-            train_y,
-            validation_data=(val_X, val_y),
-            batch_size=params.get('batch_size'),
+            # Compile the model
+            optimizer = keras.optimizers.Adam(learning_rate=get_learning_rate(params, batch_size, steps_per_epoch))
+            model.compile(loss='mse', optimizer=optimizer, metrics=['mae','accuracy'], **compile_args)
+
+            # Resume from the latest checkpoint after an interruption
+            epoch = tf.Variable(0, trainable=False, dtype=tf.int64)
+            manager = restore_checkpoint(model, optimizer, epoch, worker_index)
+            checkpoint_saver = CheckpointSaver(manager, epoch, params.get('checkpoint_epochs', 5))
+
+        # Channels sharded by S3 key already hold a different subset of files on each worker
+        sharded = distributed and get_distribution_type(channel_name) == 'ShardedByS3Key'
+
+        if distributed:
+            # Shard rows across workers, unless the channel was already sharded by S3 key
+            options = tf.data.Options()
+            if sharded:
+                options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+            else:
+                options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.DATA
+            train_input = tf.data.Dataset.from_tensor_slices((train_X, train_y)) \
+                .shuffle(len(train_X)).batch(batch_size).with_options(options)
+            val_input = tf.data.Dataset.from_tensor_slices((val_X, val_y)).batch(batch_size).with_options(options)
+            fit_args = {'x': train_input, 'validation_data': val_input}
+            probe_input = train_input
+        else:
+            # Keras feeds the arrays through its own batched pipeline, probe it on the
+            # rows of the probe steps only rather than a second copy of the training set
+            probe_rows = performance_probe_steps * batch_size
+            probe_input = tf.data.Dataset.from_tensor_slices((train_X[:probe_rows], train_y[:probe_rows])).batch(batch_size)
+            fit_args = {'x': train_X, 'y': train_y, 'validation_data': (val_X, val_y),
+                        'batch_size': batch_size, 'shuffle': True}
+
+        # Record training telemetry, with an optional profiler trace over `trace_steps` (e.g. '10,20')
+        trace_steps = None
+        if params.get('trace_steps'):
+            trace_steps = [int(step) for step in str(params.get('trace_steps')).split(',')]
+        global_rows = len(train_X) * num_workers if sharded else len(train_X)
+        performance_monitor = PerformanceMonitor(
+            global_rows,
+            probe_dataset=probe_input,
+            probe_steps=performance_probe_steps,
+            trace_steps=trace_steps,
+            trace_path=os.path.join(output_path, 'data', 'profile')
+        )
+
+        # Stop at the `target_val_loss` when one is set, used to benchmark training profiles
+        target_stop = TargetLossStop(params.get('target_val_loss'))
+
+        # Train the model
+        start_time = time.time()
+        history = model.fit(
             epochs=params.get('epochs'),
-            shuffle=True,
+            initial_epoch=int(epoch.numpy()),
             verbose=1,
-            callbacks=[early_stop]
+            callbacks=[early_stop, target_stop, checkpoint_saver, performance_monitor],
+            **fit_args
         )
+        duration = time.time() - start_time
+
+        # Only the chief worker reports and persists the model
+        if worker_index != 0:
+            return
+
+        # Rows processed per worker
+        worker_throughput = global_rows / num_workers * len(history.epoch) / duration
+        report = {
+            'num_workers': num_workers,
+            'global_batch_size': batch_size,
+            'epochs': len(history.epoch),
+            'duration_seconds': duration,
+            'worker_samples_per_second': worker_throughput,
+            'samples_per_second': worker_throughput * num_workers,
+            'time_to_target_seconds': target_stop.time_to_target,
+            'val_loss': [float(loss) for loss in history.history.get('val_loss', [])]
+        }
+        # Scaling efficiency against the throughput of a single worker run
+        if params.get('baseline_throughput'):
+            report['scaling_efficiency'] = worker_throughput / params.get('baseline_throughput')
+        write_scaling_report(report)
+        performance_monitor.write_report(os.path.join(output_path, 'data'))
         
+        # Serve in float32, copying the trained weights into a float32 build of the model
+        if is_enabled(params, 'mixed_precision'):
+            set_precision({})
+            trained_model, model = model, build_model(params)
+            model.set_weights(trained_model.get_weights())
+
         # Save the model as a single 'h5' file without the optimizer
         print("Saving Model ...")
         model.save(
@@ -141,6 +751,29 @@ def train():
             save_format="h5"
         )
 
+        # Export the preprocessing so the serving container applies it to raw requests
+        features.save_spec(model_path)
+
+        # Files consumed by the incremental runs, read back by the next one
+        if incremental:
+            with open(os.path.join(model_path, manifest_file), 'w') as f:
+                json.dump(manifest, f, indent=4)
+
+        # Export optimized inference artifacts, e.g. 'tflite,tflite_int8,savedmodel,onnx'
+        if params.get('export_formats'):
+            try:
+                import export
+                export.export_all(
+                    model,
+                    model_path,
+                    val_X,
+                    str(params.get('export_formats')).split(','),
+                    tolerance=params.get('export_tolerance', 0.01)
+                )
+            except Exception as e:
+                # The job still succeeds with the `h5` model
+                print("Export failed: {}".format(e))
+
     except Exception as e:
         # Write out an error file. This will be returned as the failureReason in the
         # `DescribeTrainingJob` result.
@@ -154,13 +787,51 @@ def train():
         # A non-zero exit code causes the training job to be marked as Failed.
         sys.exit(255)
 
-# Define function called for local testing
-def predict(payload, algorithm):
-    print("Local Testing Mode ...")
+def parse_rows(text):
+    """ Parse rows of a local test payload without evaluating code.
+
+    Args:
+        text: (str) A Python/JSON literal of a row or a list of rows, or a CSV line.
+
+    Returns: A list of rows.
+    """
+    text = text.strip()
+    if text.startswith('['):
+        rows = ast.literal_eval(text)
+    else:
+        rows = [float(value) for value in text.split(',')]
+    if len(rows) > 0 and not isinstance(rows[0], (list, tuple)):
+        rows = [rows]
+    return rows
+
+
+def iter_batches(lines, batch_size):
+    """ Group the rows of a stream of payload lines into batches.
 
+    Args:
+        lines: (iterable) Payload lines, see `parse_rows`, blank lines are skipped.
+        batch_size: (int) Rows per batch.
+
+    Yields: Float32 arrays of up to `batch_size` rows.
+    """
+    batch = []
+    for line in lines:
+        if not line.strip():
+            continue
+        batch.extend(parse_rows(line))
+        while len(batch) >= batch_size:
+            yield np.asarray(batch[:batch_size], dtype=np.float32)
+            batch = batch[batch_size:]
+    if batch:
+        yield np.asarray(batch, dtype=np.float32)
+
+
+# Define function called for local testing
+def predict(payload, algorithm, batch_size=None):
     if algorithm is None:
         raise ValueError("Please provide the algorithm specification")
-    payload = np.asarray(payload) # Convert the payload to numpy array
-    payload = payload.reshape(1, -1) # Vectorize the payload
+    payload = np.asarray(payload, dtype=np.float32) # Convert the payload to numpy array
+    if payload.ndim == 1:
+        payload = payload.reshape(1, -1) # Vectorize a single row
     
-    return algorithm.predict(payload).tolist()
\ No newline at end of file
+    return algorithm.predict(payload, batch_size=batch_size).tolist()
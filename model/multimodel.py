@@ -0,0 +1,123 @@
+import os
+import time
+import threading
+import collections
+import runtimes
+import features
+
+# Directory of the models served in multi-model mode, one sub-directory per
+# model ID holding its inference artifacts, disabled when unset
+models_dir = os.environ.get('MULTI_MODEL_DIR')
+
+# Memory budget of the loaded models per worker, and maximum number of loaded models
+memory_mb = float(os.environ.get('MULTI_MODEL_MEMORY_MB', 1024))
+max_models = int(os.environ.get('MULTI_MODEL_MAX', 100))
+
+# Request header naming the target model, the header SageMaker sets for `TargetModel`
+target_header = 'X-Amzn-SageMaker-Target-Model'
+
+
+def get_size_mb(path):
+    """ Size of the model artifacts on disk, the memory estimate of a loaded model.
+    """
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names) / (1024 * 1024)
+
+
+class ModelRegistry(object):
+    """ Memory-bounded LRU of the models loaded by a worker.
+
+    Models are loaded on first use and the least recently used ones are
+    evicted once the loaded artifacts exceed the memory budget. Concurrent
+    requests for a model being loaded wait for that load instead of loading
+    it again.
+    """
+    def __init__(self, path, backend, memory_mb=memory_mb, max_models=max_models):
+        self.path = path
+        self.backend = backend
+        self.memory_mb = memory_mb
+        self.max_models = max_models
+        self.models = collections.OrderedDict()
+        self.loading = {}
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'collapsed': 0, 'evictions': 0, 'load_seconds': 0.0}
+        self.load_times = {}
+
+    def get_model_dir(self, model_id):
+        """ Local directory of a model.
+
+        Raises: KeyError if the model does not exist.
+        """
+        model_dir = os.path.join(self.path, model_id)
+        if not model_id or os.path.basename(model_id) != model_id or model_id.startswith('.') \
+                or not os.path.isdir(model_dir):
+            raise KeyError(model_id)
+        return model_dir
+
+    def get(self, model_id):
+        """ Get a loaded model, loading it if needed.
+
+        Args:
+            model_id: (str) Sub-directory of the model in the models directory.
+
+        Returns: A tuple of the runtime backend and the preprocessor of the model.
+
+        Raises: KeyError if the model does not exist.
+        """
+        with self.lock:
+            if model_id in self.models:
+                self.models.move_to_end(model_id)
+                self.stats['hits'] += 1
+                return self.models[model_id][:2]
+            model_dir = self.get_model_dir(model_id)
+            load_lock = self.loading.setdefault(model_id, threading.Lock())
+
+        with load_lock:
+            with self.lock:
+                if model_id in self.models:
+                    # Loaded by a concurrent request while this one waited
+                    self.models.move_to_end(model_id)
+                    self.stats['collapsed'] += 1
+                    return self.models[model_id][:2]
+
+            start_time = time.perf_counter()
+            backend = runtimes.load_backend(self.backend, model_dir)
+            preprocessor = features.Preprocessor.load(model_dir)
+            load_seconds = time.perf_counter() - start_time
+
+            with self.lock:
+                self.models[model_id] = (backend, preprocessor, get_size_mb(model_dir))
+                self.loading.pop(model_id, None)
+                self.stats['misses'] += 1
+                self.stats['load_seconds'] += load_seconds
+                self.load_times[model_id] = load_seconds
+                self.evict()
+            print("Loaded model {} in {:.3f}s".format(model_id, load_seconds))
+            return backend, preprocessor
+
+    def evict(self):
+        """ Evict the least recently used models beyond the budget, keeping the most recent one.
+        """
+        while len(self.models) > 1 and (len(self.models) > self.max_models or self.get_loaded_mb() > self.memory_mb):
+            model_id, _ = self.models.popitem(last=False)
+            self.stats['evictions'] += 1
+            print("Evicted model {}".format(model_id))
+
+    def get_loaded_mb(self):
+        return sum(entry[2] for entry in self.models.values())
+
+    def report(self):
+        """ Loaded models and cache statistics of this worker.
+        """
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'loaded': list(self.models.keys()),
+                'loaded_mb': self.get_loaded_mb(),
+                'model_load_seconds': dict(self.load_times),
+                **self.stats
+            }
+
+
+# Model registry of this worker process, None outside multi-model mode
+registry = ModelRegistry(models_dir, os.environ.get('MODEL_BACKEND', 'keras')) if models_dir else None
@@ -0,0 +1,90 @@
+import time
+import socket
+import argparse
+import collections
+import urllib.error
+import urllib.request
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+def send(url, body, timeout_ms):
+    """ Send one request with a time budget.
+
+    The `X-Request-Start` header stands in for nginx when the server is
+    reached directly, e.g. a local gunicorn.
+
+    Returns: A tuple of the outcome and the latency in milliseconds.
+    """
+    start = time.time()
+    request = urllib.request.Request(url, data=body, headers={
+        'Content-Type': 'text/csv',
+        'X-Request-Start': 't={:.3f}'.format(start),
+        'X-Request-Timeout-Ms': str(timeout_ms)
+    })
+    try:
+        with urllib.request.urlopen(request, timeout=timeout_ms / 1000) as response:
+            response.read()
+            outcome = 'ok'
+    except urllib.error.HTTPError as e:
+        outcome = str(e.code)
+    except (socket.timeout, TimeoutError):
+        outcome = 'timeout'
+    except urllib.error.URLError as e:
+        outcome = 'timeout' if isinstance(e.reason, (socket.timeout, TimeoutError)) else 'error'
+    except OSError:
+        outcome = 'error'
+    latency_ms = (time.time() - start) * 1000
+    if outcome == 'ok' and latency_ms > timeout_ms:
+        outcome = 'late'
+    return outcome, latency_ms
+
+
+def run(url, body, rate, duration, timeout_ms, clients=256):
+    """ Offer an open-loop load at a fixed rate, whatever the server keeps up with.
+
+    Args:
+        url: (str) Invocations URL.
+        body: (bytes) CSV request body.
+        rate: (float) Requests per second.
+        duration: (float) Seconds of load.
+        timeout_ms: (float) Client time budget of each request.
+        clients: (int) Maximum concurrent requests.
+
+    Returns: A dictionary of outcome counts, goodput and latency of the successful requests.
+    """
+    futures = []
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        for i in range(int(rate * duration)):
+            delay = start + i / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(executor.submit(send, url, body, timeout_ms))
+    results = [future.result() for future in futures]
+
+    outcomes = collections.Counter(outcome for outcome, _ in results)
+    latencies = [latency for outcome, latency in results if outcome == 'ok']
+    return {
+        'offered_per_second': rate,
+        'goodput_per_second': outcomes['ok'] / duration,
+        'outcomes': dict(outcomes),
+        'latency_p50_ms': float(np.percentile(latencies, 50)) if latencies else None,
+        'latency_p99_ms': float(np.percentile(latencies, 99)) if latencies else None
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Overload test of the model server")
+    parser.add_argument('data', type=str, help="CSV of featurized rows or raw records, without header")
+    parser.add_argument('--url', type=str, default='http://localhost:8080/invocations')
+    parser.add_argument('--rows', type=int, default=1, help="Rows per request")
+    parser.add_argument('--rates', type=str, default='10,20,40,80', help="Offered requests per second")
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--timeout-ms', type=float, default=1000)
+    args = parser.parse_args()
+
+    with open(args.data, 'r') as f:
+        body = ''.join(f.readline() for _ in range(args.rows)).encode('utf-8')
+    for rate in args.rates.split(','):
+        print(run(args.url, body, float(rate), args.duration, args.timeout_ms))
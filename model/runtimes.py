@@ -0,0 +1,94 @@
+import os
+import numpy as np
+
+# TensorFlow is imported by the backends that need it, the ONNX backend serves without it
+
+# Inference artifacts written next to `model.h5` by the export stage
+artifacts = {
+    'keras': 'model.h5',
+    'tflite': 'model.tflite',
+    'tflite_int8': 'model_int8.tflite',
+    'savedmodel': 'savedmodel',
+    'onnx': 'model.onnx'
+}
+
+
+class KerasBackend(object):
+    """ Serve the float32 Keras `h5` model.
+    """
+    def __init__(self, path):
+        import tensorflow as tf
+        self.model = tf.keras.models.load_model(path)
+        self.model.compile(optimizer='adam', loss='mse')
+
+    def predict(self, X, batch_size=None):
+        return self.model.predict(X, batch_size=batch_size)
+
+
+class TFLiteBackend(object):
+    """ Serve a (quantized) TFLite model, resizing the input to the batch.
+    """
+    def __init__(self, path):
+        import tensorflow as tf
+        self.interpreter = tf.lite.Interpreter(model_path=path)
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.shape = None
+
+    def predict(self, X, batch_size=None):
+        X = np.asarray(X, dtype=np.float32)
+        if self.shape != X.shape:
+            self.interpreter.resize_tensor_input(self.input_index, X.shape)
+            self.interpreter.allocate_tensors()
+            self.shape = X.shape
+        self.interpreter.set_tensor(self.input_index, X)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index)
+
+
+class SavedModelBackend(object):
+    """ Serve the graph-frozen SavedModel through its serving signature.
+    """
+    def __init__(self, path):
+        import tensorflow as tf
+        self.function = tf.saved_model.load(path).signatures['serving_default']
+
+    def predict(self, X, batch_size=None):
+        import tensorflow as tf
+        outputs = self.function(tf.constant(X, dtype=tf.float32))
+        return next(iter(outputs.values())).numpy()
+
+
+class OnnxBackend(object):
+    """ Serve the ONNX model with ONNX Runtime.
+    """
+    def __init__(self, path):
+        import onnxruntime
+        self.session = onnxruntime.InferenceSession(path)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, X, batch_size=None):
+        return self.session.run(None, {self.input_name: np.asarray(X, dtype=np.float32)})[0]
+
+
+backends = {
+    'keras': KerasBackend,
+    'tflite': TFLiteBackend,
+    'tflite_int8': TFLiteBackend,
+    'savedmodel': SavedModelBackend,
+    'onnx': OnnxBackend
+}
+
+
+def load_backend(name, path):
+    """ Load an inference artifact with its runtime backend.
+
+    Args:
+        name: (str) Backend name, one of `backends`.
+        path: (str) Model directory.
+
+    Returns: A backend exposing `predict(X, batch_size=None)`.
+    """
+    if name not in backends:
+        raise ValueError("Unknown model backend: {}, expected one of {}".format(name, list(backends)))
+    return backends[name](os.path.join(path, artifacts[name]))
@@ -0,0 +1,186 @@
+import re
+import json
+import heapq
+import argparse
+import numpy as np
+import pandas as pd
+
+# Seconds between two evaluations of a scaling policy, the CloudWatch metric period
+period = 60
+
+# Metric of each policy: invocations per instance and minute, or the fraction
+# of time the workers are busy (see metrics.py)
+policies = ['invocations', 'utilization']
+
+# Timings of an invocation in the nginx access log: end time, duration, rows and worker time
+access_log_pattern = re.compile(r'"POST /invocations[^"]*".* timing=([\d.]+),([\d.]+),([\d.]+|-),([\d.]+|-)')
+
+
+def parse_access_log(lines):
+    """ Parse the requests of nginx access log lines in the `timing` format (see nginx.conf).
+
+    Every request is logged, unlike the sampled capture batches, so the trace
+    holds the full invocation count and worker time. Other lines are skipped.
+
+    Returns: A DataFrame of `timestamp` (arrival, epoch seconds), `rows` and
+        `service_ms`, missing for requests turned away before the worker.
+    """
+    records = []
+    for line in lines:
+        match = access_log_pattern.search(line)
+        if match is None:
+            continue
+        end, duration, rows, service_ms = match.groups()
+        records.append((float(end) - float(duration),
+                        float(rows) if rows != '-' else np.nan,
+                        float(service_ms) if service_ms != '-' else np.nan))
+    return pd.DataFrame(records, columns=['timestamp', 'rows', 'service_ms'])
+
+
+def load_trace(path):
+    """ Load a traffic trace of one request per row.
+
+    Args:
+        path: (str) CSV file with `timestamp` (epoch seconds), `rows` and an
+            optional `service_ms` column, or an nginx access log of the model
+            server. The sampled capture batches undercount the traffic and
+            are not a trace.
+
+    Returns: A DataFrame sorted by timestamp.
+    """
+    if path.endswith('.csv'):
+        frame = pd.read_csv(path)
+    else:
+        with open(path, 'r') as f:
+            frame = parse_access_log(f)
+        if frame.empty:
+            raise ValueError("No requests in the `timing` format found in {}".format(path))
+    return frame.sort_values('timestamp').reset_index(drop=True)
+
+
+def get_desired(policy, target, instances, invocations, busy_seconds, workers):
+    """ Instance count a target tracking policy asks for.
+
+    Args:
+        policy: (str) 'invocations' or 'utilization'.
+        target: (float) Target value of the metric.
+        instances: (int) Instances in service during the period.
+        invocations: (int) Requests started during the period.
+        busy_seconds: (float) Worker time spent serving requests during the period.
+        workers: (int) Workers per instance.
+
+    Returns: The desired instance count.
+    """
+    if policy == 'invocations':
+        value = invocations / instances * 60 / period
+    else:
+        value = busy_seconds / (instances * workers * period)
+    return int(np.ceil(instances * value / target))
+
+
+def simulate(trace, policy, target, workers=2, min_instances=1, max_instances=10,
+             warmup=300, scale_out_cooldown=60, scale_in_cooldown=300, slo_ms=100.0):
+    """ Replay a trace through a fleet scaled by a target tracking policy.
+
+    Every instance is a FIFO queue served by its workers, requests are spread
+    round-robin over the instances in service. New instances take `warmup`
+    seconds before they receive traffic.
+
+    Args:
+        trace: (DataFrame) Requests with `timestamp`, `rows` and `service_ms`.
+        policy: (str) 'invocations' or 'utilization'.
+        target: (float) Target value of the policy metric.
+
+    Returns: A dictionary of latency percentiles, SLO violations and instance hours.
+    """
+    start = trace['timestamp'].iloc[0]
+    arrivals = (trace['timestamp'] - start).to_numpy(dtype=float)
+    services = trace['service_ms'].to_numpy(dtype=float) / 1000
+
+    # Free time of each worker of the instances in service, ready time of pending instances
+    fleet = [[0.0] * workers for _ in range(min_instances)]
+    pending = []
+    latencies = np.empty(len(arrivals))
+    instance_seconds = 0.0
+    peak = min_instances
+    actions = 0
+    last_out = last_in = -np.inf
+    boundary = period
+    invocations, busy_seconds, turn = 0, 0.0, 0
+
+    for i, (arrival, service) in enumerate(zip(arrivals, services)):
+        while arrival >= boundary:
+            # Metric of the elapsed period, then the scaling decision
+            instance_seconds += (len(fleet) + len(pending)) * period
+            desired = min(max_instances, max(min_instances, get_desired(
+                policy, target, len(fleet), invocations, busy_seconds, workers)))
+            current = len(fleet) + len(pending)
+            if desired > current and boundary - last_out >= scale_out_cooldown:
+                pending.extend([boundary + warmup] * (desired - current))
+                last_out = boundary
+                actions += 1
+            elif desired < current and not pending and boundary - last_in >= scale_in_cooldown:
+                del fleet[desired:]
+                last_in = boundary
+                actions += 1
+            fleet.extend([[boundary] * workers for ready in pending if ready <= boundary])
+            pending = [ready for ready in pending if ready > boundary]
+            peak = max(peak, current, desired)
+            invocations, busy_seconds = 0, 0.0
+            boundary += period
+
+        instance = fleet[turn % len(fleet)]
+        turn += 1
+        begin = max(arrival, heapq.heappop(instance))
+        heapq.heappush(instance, begin + service)
+        latencies[i] = (begin + service - arrival) * 1000
+        invocations += 1
+        busy_seconds += service
+
+    return {
+        'policy': policy,
+        'target': target,
+        'latency_p50_ms': float(np.percentile(latencies, 50)),
+        'latency_p90_ms': float(np.percentile(latencies, 90)),
+        'latency_p99_ms': float(np.percentile(latencies, 99)),
+        'slo_violations': float(np.mean(latencies > slo_ms)),
+        'instance_hours': instance_seconds / 3600,
+        'peak_instances': peak,
+        'scaling_actions': actions
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a traffic trace through scaling policies")
+    parser.add_argument('trace', type=str, help="CSV trace or nginx access log")
+    parser.add_argument('--invocations-targets', type=str, default='250,500,750')
+    parser.add_argument('--utilization-targets', type=str, default='0.5,0.6,0.7')
+    parser.add_argument('--fixed-ms', type=float, default=2.0, help="Cost of a request without `service_ms`")
+    parser.add_argument('--row-ms', type=float, default=0.05, help="Cost of a row without `service_ms`")
+    parser.add_argument('--speedup', type=float, default=1.0, help="Replay the trace this many times faster")
+    parser.add_argument('--workers', type=int, default=2, help="Workers per instance")
+    parser.add_argument('--min-instances', type=int, default=2)
+    parser.add_argument('--max-instances', type=int, default=10)
+    parser.add_argument('--warmup', type=float, default=300, help="Seconds before a new instance serves")
+    parser.add_argument('--slo-ms', type=float, default=100.0)
+    parser.add_argument('--output', type=str, help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    trace = load_trace(args.trace)
+    if 'rows' not in trace:
+        trace['rows'] = 1
+    estimate = args.fixed_ms + args.row_ms * trace['rows'].fillna(1)
+    trace['service_ms'] = trace['service_ms'].fillna(estimate) if 'service_ms' in trace else estimate
+    trace['timestamp'] = trace['timestamp'] / args.speedup
+
+    results = []
+    for policy, targets in zip(policies, [args.invocations_targets, args.utilization_targets]):
+        for target in targets.split(','):
+            results.append(simulate(trace, policy, float(target), workers=args.workers,
+                                    min_instances=args.min_instances, max_instances=args.max_instances,
+                                    warmup=args.warmup, slo_ms=args.slo_ms))
+
+    print(pd.DataFrame(results).to_string(index=False))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
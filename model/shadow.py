@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import socket
+import hashlib
+import tarfile
+import argparse
+import collections
+import numpy as np
+import runtimes
+import features
+from capture import get_original
+
+# Candidate model scored next to the primary one, a local model directory or
+# the S3 URI of a training job `model.tar.gz`, disabled when unset
+shadow_model = os.environ.get('SHADOW_MODEL_PATH')
+
+# Where the comparison report is written, a local directory or S3 prefix
+report_destination = os.environ.get('SHADOW_REPORT_DESTINATION', '/tmp/shadow')
+
+# Seconds between two reports
+report_interval = float(os.environ.get('SHADOW_REPORT_INTERVAL', 60))
+
+# The candidate is reported slower when its p90 latency exceeds the primary one
+# by this fraction, drifted when its mean absolute prediction delta exceeds the tolerance
+latency_tolerance = float(os.environ.get('SHADOW_LATENCY_TOLERANCE', 0.1))
+delta_tolerance = float(os.environ.get('SHADOW_DELTA_TOLERANCE', 0.01))
+
+# Batches waiting for the candidate before new ones are dropped
+max_pending = 1000
+
+# Latencies and deltas kept for the percentiles
+window_size = 10000
+
+# Local directory of a candidate model downloaded from S3
+download_path = '/opt/ml/shadow'
+
+
+def get_model_dir(path):
+    """ Local model directory of a candidate model.
+
+    A `model.tar.gz` in S3 is downloaded and extracted once per container: the
+    first worker holds a file lock while it extracts to a directory of its own,
+    renamed into place when complete, the other workers wait and reuse it.
+
+    Args:
+        path: (str) Local model directory, or S3 URI of a `model.tar.gz`
+            extracted under `download_path`.
+
+    Returns: The local model directory.
+    """
+    if not path.startswith('s3://'):
+        return path
+    model_dir = os.path.join(download_path, hashlib.sha1(path.encode('utf-8')).hexdigest()[:16])
+    os.makedirs(download_path, exist_ok=True)
+    with open(model_dir + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.isdir(model_dir):
+            import boto3
+            bucket, key = path[len('s3://'):].split('/', 1)
+            staging = '{}.{}'.format(model_dir, os.getpid())
+            shutil.rmtree(staging, ignore_errors=True)
+            os.makedirs(staging)
+            archive = os.path.join(staging, 'model.tar.gz')
+            boto3.client('s3').download_file(bucket, key, archive)
+            with tarfile.open(archive, mode='r:gz') as tar:
+                tar.extractall(staging)
+            os.remove(archive)
+            os.rename(staging, model_dir)
+    return model_dir
+
+
+class Comparison(object):
+    """ Side-by-side latency and prediction deltas of the primary and candidate models.
+    """
+    def __init__(self):
+        self.batches = 0
+        self.rows = 0
+        self.errors = 0
+        self.dropped = 0
+        self.abs_delta_sum = 0.0
+        self.delta_sum = 0.0
+        self.max_abs_delta = 0.0
+        self.primary_ms = collections.deque(maxlen=window_size)
+        self.candidate_ms = collections.deque(maxlen=window_size)
+        self.abs_deltas = collections.deque(maxlen=window_size)
+
+    def add(self, primary, candidate, primary_ms, candidate_ms):
+        """ Record one batch scored by both models.
+
+        Args:
+            primary: (NumPy) Predictions returned to the client.
+            candidate: (NumPy) Predictions of the candidate model.
+            primary_ms: (float) Time taken by the primary model.
+            candidate_ms: (float) Time taken by the candidate model.
+        """
+        delta = np.asarray(candidate, dtype=np.float64).flatten() - np.asarray(primary, dtype=np.float64).flatten()
+        self.batches += 1
+        self.rows += len(delta)
+        self.delta_sum += float(np.sum(delta))
+        self.abs_delta_sum += float(np.sum(np.abs(delta)))
+        self.max_abs_delta = max(self.max_abs_delta, float(np.max(np.abs(delta), initial=0.0)))
+        self.abs_deltas.extend(np.abs(delta))
+        self.primary_ms.append(primary_ms)
+        self.candidate_ms.append(candidate_ms)
+
+    def report(self):
+        """ Summarize the comparison.
+
+        Returns: A dictionary with the latency percentiles of both models, the
+            prediction deltas, and whether the candidate is slower or drifts.
+        """
+        report = {'batches': self.batches, 'rows': self.rows, 'errors': self.errors, 'dropped': self.dropped}
+        if self.batches == 0:
+            return report
+        for name, times in [('primary', self.primary_ms), ('candidate', self.candidate_ms)]:
+            report[name] = {
+                'latency_p50_ms': float(np.percentile(times, 50)),
+                'latency_p90_ms': float(np.percentile(times, 90)),
+                'latency_p99_ms': float(np.percentile(times, 99))
+            }
+        report['mean_delta'] = self.delta_sum / self.rows
+        report['mean_abs_delta'] = self.abs_delta_sum / self.rows
+        report['p99_abs_delta'] = float(np.percentile(self.abs_deltas, 99))
+        report['max_abs_delta'] = self.max_abs_delta
+        report['slower'] = bool(report['candidate']['latency_p90_ms'] >
+                                report['primary']['latency_p90_ms'] * (1 + latency_tolerance))
+        report['drifted'] = bool(report['mean_abs_delta'] > delta_tolerance)
+        return report
+
+
+class ShadowModel(object):
+    """ Score the request batches on a candidate model off the request path.
+
+    Batches are queued with the primary predictions and scored by a background
+    thread, which also writes the comparison report every `report_interval`
+    seconds. The client only ever receives the primary predictions.
+    """
+    def __init__(self, path, backend):
+        model_dir = get_model_dir(path)
+        self.model = runtimes.load_backend(backend, model_dir)
+        self.preprocessor = features.Preprocessor.load(model_dir)
+        self.comparison = Comparison()
+        self.pending = collections.deque()
+        self.sleep = get_original('time', 'sleep')
+        self.thread = None
+
+    def submit(self, data, predictions, primary_ms):
+        """ Queue a batch scored by the primary model, never blocks.
+        """
+        if len(self.pending) >= max_pending:
+            self.comparison.dropped += 1
+            return
+        if self.thread is None:
+            self.thread = get_original('threading', 'Thread')(target=self.run, daemon=True)
+            self.thread.start()
+        self.pending.append((data, predictions, primary_ms))
+
+    def score(self, data, predictions, primary_ms):
+        start_time = time.perf_counter()
+        try:
+            candidate = self.model.predict(self.preprocessor.transform(data))
+        except Exception as e:
+            self.comparison.errors += 1
+            print("Candidate model failed: {}".format(e))
+            return
+        self.comparison.add(predictions, candidate, primary_ms, (time.perf_counter() - start_time) * 1000)
+
+    def run(self):
+        last_report = time.monotonic()
+        while True:
+            if self.pending:
+                self.score(*self.pending.popleft())
+            else:
+                self.sleep(0.01)
+            if time.monotonic() - last_report >= report_interval:
+                write_report(self.comparison.report())
+                last_report = time.monotonic()
+
+
+def write_report(report, destination=None):
+    """ Write a comparison report, one file per worker process.
+    """
+    destination = (destination or report_destination).rstrip('/')
+    name = 'shadow-report-{}-{}.json'.format(socket.gethostname(), os.getpid())
+    body = json.dumps(report, indent=4)
+    if destination.startswith('s3://'):
+        import boto3
+        bucket, _, prefix = destination[len('s3://'):].partition('/')
+        boto3.client('s3').put_object(Bucket=bucket, Key='{}/{}'.format(prefix, name).lstrip('/'), Body=body)
+    else:
+        os.makedirs(destination, exist_ok=True)
+        with open(os.path.join(destination, name), 'w') as f:
+            f.write(body)
+
+
+def compare(primary_path, candidate_path, data, batch_size=100, backend='keras'):
+    """ Compare two models offline over a dataset, batch by batch.
+
+    Args:
+        primary_path: (str) Model directory of the primary model.
+        candidate_path: (str) Model directory or S3 `model.tar.gz` of the candidate.
+        data: (NumPy) Featurized rows or raw records.
+        batch_size: (int) Rows per request.
+        backend: (str) Runtime backend of both models, see `runtimes.py`.
+
+    Returns: The comparison report.
+    """
+    primary = runtimes.load_backend(backend, primary_path)
+    preprocessor = features.Preprocessor.load(primary_path)
+    shadow = ShadowModel(candidate_path, backend)
+    for start in range(0, len(data), batch_size):
+        batch = data[start:start + batch_size]
+        start_time = time.perf_counter()
+        predictions = primary.predict(preprocessor.transform(batch))
+        shadow.score(batch, predictions, (time.perf_counter() - start_time) * 1000)
+    return shadow.comparison.report()
+
+
+if __name__ == '__main__':
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Compare a candidate model with the primary model")
+    parser.add_argument('primary', type=str, help="Model directory of the primary model")
+    parser.add_argument('candidate', type=str, help="Model directory or S3 model.tar.gz of the candidate")
+    parser.add_argument('data', type=str, help="CSV of featurized rows or raw records, without header")
+    parser.add_argument('--label-column', action='store_true', help="Drop the first column of the CSV")
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--backend', type=str, default='keras')
+    parser.add_argument('--output', type=str, help="Directory or S3 prefix of the report")
+    args = parser.parse_args()
+
+    data = pd.read_csv(args.data, header=None).to_numpy()
+    if args.label_column:
+        data = data[:, 1:]
+    report = compare(args.primary, args.candidate, data, batch_size=args.batch_size, backend=args.backend)
+    print(json.dumps(report, indent=4))
+    if args.output:
+        write_report(report, args.output)
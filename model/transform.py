@@ -0,0 +1,303 @@
+import os
+import io
+import json
+import argparse
+import collections
+import multiprocessing
+import pandas as pd
+import runtimes
+import features
+
+# Marker written to the output once every chunk has been scored
+success_file = '_SUCCESS'
+
+# Chunking of a previous run, resuming requires the same chunk boundaries
+manifest_file = '_manifest.json'
+
+# Model directory of a SageMaker container
+default_model_dir = '/opt/ml/model'
+
+# Part writer, runtime backend and preprocessing of each worker process
+writer = None
+model = None
+preprocessor = None
+
+
+def split_s3_uri(uri):
+    """ Split an S3 URI into bucket and key.
+
+    Args:
+        uri: (str) S3 URI, e.g. 's3://bucket/prefix'.
+
+    Returns: A tuple of the bucket and key.
+    """
+    bucket, _, key = uri[len('s3://'):].partition('/')
+    return bucket, key
+
+
+def list_sources(input_uri):
+    """ List the input files of a batch transform, in input order.
+
+    Args:
+        input_uri: (str) Local file or directory, or S3 prefix.
+
+    Returns: Sorted list of file paths or S3 URIs.
+    """
+    if input_uri.startswith('s3://'):
+        import boto3
+        bucket, prefix = split_s3_uri(input_uri)
+        paginator = boto3.client('s3').get_paginator('list_objects_v2')
+        keys = []
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            keys.extend(obj['Key'] for obj in page.get('Contents', []) if not obj['Key'].endswith('/'))
+        return ['s3://{}/{}'.format(bucket, key) for key in sorted(keys)]
+
+    if os.path.isdir(input_uri):
+        return [os.path.join(input_uri, name) for name in sorted(os.listdir(input_uri))
+                if name.endswith(('.csv', '.parquet'))]
+    return [input_uri]
+
+
+def open_source(source):
+    """ Open an input file for streaming.
+
+    Args:
+        source: (str) Local file path or S3 URI.
+
+    Returns: A binary file-like object.
+    """
+    if source.startswith('s3://'):
+        import boto3
+        bucket, key = split_s3_uri(source)
+        return boto3.client('s3').get_object(Bucket=bucket, Key=key)['Body']
+    return open(source, 'rb')
+
+
+def get_fingerprint(sources):
+    """ Identify the content of the input files, S3 ETags or local sizes and modification times.
+
+    Args:
+        sources: (list) Input files in input order.
+
+    Returns: A list of [source, version] pairs.
+    """
+    fingerprint = []
+    s3 = None
+    for source in sources:
+        if source.startswith('s3://'):
+            if s3 is None:
+                import boto3
+                s3 = boto3.client('s3')
+            bucket, key = split_s3_uri(source)
+            version = s3.head_object(Bucket=bucket, Key=key)['ETag']
+        else:
+            stat = os.stat(source)
+            version = '{}-{}'.format(stat.st_size, int(stat.st_mtime))
+        fingerprint.append([source, version])
+    return fingerprint
+
+
+def parse_csv(lines):
+    """ Parse the raw lines of a CSV chunk.
+    """
+    return pd.read_csv(io.BytesIO(b''.join(lines)), header=None).to_numpy()
+
+
+def read_chunks(sources, chunk_size):
+    """ Stream the rows of every input file in chunks.
+
+    CSV chunks are split on raw lines and only parsed when scored, so the
+    chunks a resumed run skips are never parsed.
+
+    Args:
+        sources: (list) Input files in input order.
+        chunk_size: (int) Maximum number of rows per chunk.
+
+    Yields: Functions returning the NumPy rows of a chunk, at most `chunk_size` rows.
+    """
+    for source in sources:
+        if source.endswith('.parquet'):
+            # Parquet support is optional, `pyarrow` is not part of the serving image
+            import pyarrow.parquet as pq
+            with open_source(source) as f:
+                # Parquet needs a seekable file, S3 objects are buffered
+                if source.startswith('s3://'):
+                    f = io.BytesIO(f.read())
+                parquet = pq.ParquetFile(f)
+                for batch in parquet.iter_batches(batch_size=chunk_size):
+                    rows = batch.to_pandas().to_numpy()
+                    yield lambda rows=rows: rows
+        else:
+            with open_source(source) as f:
+                lines = []
+                for line in f:
+                    # Blank lines hold no row
+                    if not line.strip():
+                        continue
+                    lines.append(line if line.endswith(b'\n') else line + b'\n')
+                    if len(lines) == chunk_size:
+                        yield lambda lines=lines: parse_csv(lines)
+                        lines = []
+                if lines:
+                    yield lambda lines=lines: parse_csv(lines)
+
+
+class PartWriter(object):
+    """ Write scored chunks as numbered part files to a local directory or S3 prefix.
+    """
+    def __init__(self, output_uri):
+        self.output_uri = output_uri.rstrip('/')
+        self.s3 = None
+        if self.output_uri.startswith('s3://'):
+            import boto3
+            self.s3 = boto3.client('s3')
+            self.bucket, self.prefix = split_s3_uri(self.output_uri)
+        else:
+            os.makedirs(self.output_uri, exist_ok=True)
+
+    def existing(self):
+        """ List the names of the files already in the output.
+
+        Returns: Set of file names.
+        """
+        if self.s3 is None:
+            return set(os.listdir(self.output_uri))
+        names = set()
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + '/'):
+            names.update(obj['Key'].rsplit('/', 1)[-1] for obj in page.get('Contents', []))
+        return names
+
+    def read(self, name):
+        """ Read a file from the output, or None if it doesn't exist.
+        """
+        if name not in self.existing():
+            return None
+        if self.s3 is None:
+            with open(os.path.join(self.output_uri, name), 'r') as f:
+                return f.read()
+        return self.s3.get_object(Bucket=self.bucket, Key='{}/{}'.format(self.prefix, name))['Body'].read().decode('utf-8')
+
+    def write(self, name, body):
+        """ Write a file to the output, local files are renamed into place once complete.
+        """
+        if self.s3 is None:
+            path = os.path.join(self.output_uri, name)
+            with open(path + '.tmp', 'w') as f:
+                f.write(body)
+            os.replace(path + '.tmp', path)
+        else:
+            self.s3.put_object(Bucket=self.bucket, Key='{}/{}'.format(self.prefix, name), Body=body.encode('utf-8'))
+
+
+def part_name(index):
+    """ Name of the part file holding the predictions of a chunk.
+    """
+    return 'part-{:05d}.csv'.format(index)
+
+
+def init_worker(model_dir, output_uri, workers):
+    """ Load the model once per worker process.
+
+    Only the runtime backend and the preprocessing are loaded, not the serving
+    app, so a batch job never starts the capture, shadow or warm-up threads.
+
+    Args:
+        model_dir: (str) Directory of the inference artifacts.
+        output_uri: (str) Output directory or S3 prefix for the part files.
+        workers: (int) Number of worker processes sharing the CPUs.
+    """
+    global writer, model, preprocessor
+    writer = PartWriter(output_uri)
+
+    backend = os.environ.get('MODEL_BACKEND', 'keras')
+    if backend != 'onnx':
+        import tensorflow as tf
+        threads = max(1, multiprocessing.cpu_count() // workers)
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    model = runtimes.load_backend(backend, model_dir)
+    preprocessor = features.Preprocessor.load(model_dir)
+
+
+def score_chunk(index, rows, batch_size):
+    """ Score a chunk of rows and write its predictions as a part file.
+
+    Args:
+        index: (int) Chunk index, names the part file.
+        rows: (NumPy) Rows of the chunk.
+        batch_size: (int) Number of rows scored per model call.
+
+    Returns: The number of rows scored.
+    """
+    predictions = model.predict(preprocessor.transform(rows), batch_size=batch_size)
+    out = io.StringIO()
+    pd.DataFrame({'results': predictions.flatten()}).to_csv(out, header=False, index=False)
+    writer.write(part_name(index), out.getvalue())
+    return len(rows)
+
+
+def run(input_uri, output_uri, chunk_size, batch_size, workers, model_dir=default_model_dir):
+    """ Score every row of the input and write the predictions in input order.
+
+    At most two chunks per worker are held in memory. Part files already in the
+    output are skipped, so a failed run resumes where it stopped.
+
+    Args:
+        input_uri: (str) Local file or directory, or S3 prefix of CSV/Parquet files.
+        output_uri: (str) Output directory or S3 prefix for the part files.
+        chunk_size: (int) Number of rows per chunk (and part file).
+        batch_size: (int) Number of rows scored per model call.
+        workers: (int) Number of scoring processes.
+        model_dir: (str) Directory of the inference artifacts.
+    """
+    output = PartWriter(output_uri)
+    sources = list_sources(input_uri)
+
+    # Resuming is only safe over the same input and with the chunk boundaries of the previous run
+    manifest = {'input': input_uri, 'sources': get_fingerprint(sources), 'chunk_size': chunk_size}
+    previous = output.read(manifest_file)
+    if previous is not None:
+        previous = json.loads(previous)
+        if previous.get('chunk_size') != chunk_size:
+            raise ValueError("Output was written with chunk size {}, resume with the same chunk size".format(
+                previous.get('chunk_size')))
+        if previous.get('input') != input_uri or previous.get('sources') != manifest['sources']:
+            raise ValueError("Output was written from a different input, write to a new output")
+    output.write(manifest_file, json.dumps(manifest))
+    done = output.existing()
+
+    # The model loads in fresh processes, TF does not survive a fork
+    context = multiprocessing.get_context('spawn')
+    pending = collections.deque()
+    scored = skipped = 0
+    with context.Pool(workers, initializer=init_worker, initargs=(model_dir, output_uri, workers)) as pool:
+        for index, read in enumerate(read_chunks(sources, chunk_size)):
+            if part_name(index) in done:
+                skipped += 1
+                continue
+            rows = read()
+
+            # Bound the chunks in flight, waiting on the oldest first
+            while len(pending) >= 2 * workers:
+                scored += pending.popleft().get()
+            pending.append(pool.apply_async(score_chunk, (index, rows, batch_size)))
+
+        while pending:
+            scored += pending.popleft().get()
+
+    output.write(success_file, '')
+    print("Scored {} rows, skipped {} chunks already written".format(scored, skipped))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='app.py transform')
+    parser.add_argument("input", type=str, help="CSV/Parquet file, directory or S3 prefix")
+    parser.add_argument("output", type=str, help="Output directory or S3 prefix")
+    parser.add_argument("--chunk-size", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--model-dir", type=str, default=default_model_dir, help="Directory of the inference artifacts")
+    args = parser.parse_args(argv)
+
+    run(args.input, args.output, args.chunk_size, args.batch_size, args.workers, model_dir=args.model_dir)
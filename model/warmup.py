@@ -0,0 +1,102 @@
+import os
+import time
+import json
+import numpy as np
+from capture import get_original
+
+# Batch sizes run through the inference path before a worker reports healthy,
+# e.g. the common request sizes, and number of runs per batch size
+batch_sizes = [int(size) for size in os.environ.get('WARMUP_BATCH_SIZES', '1,16,128').split(',') if size]
+rounds = int(os.environ.get('WARMUP_ROUNDS', 3))
+
+# Directory of the markers of the warmed workers, one sub-directory per server run
+state_path = os.environ.get('WARMUP_STATE_PATH', '/tmp/warmup')
+
+
+def get_rows(count, width):
+    """ Synthetic L2 normalized rows, like the featurized requests.
+    """
+    rows = np.random.default_rng(0).random((count, width), dtype=np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+class Warmup(object):
+    """ Load the model and run synthetic batches through it on a background
+    thread when a worker starts.
+
+    A worker reports healthy once every worker of the server has warmed up, so
+    the first real requests after a scale-out don't pay for the graph tracing
+    and kernel initialization. Workers leave a marker named after their PID in
+    a directory of the gunicorn master, and the server stays healthy once all
+    of them have warmed, even while a restarted worker warms again.
+    """
+    def __init__(self):
+        self.done = False
+        self.thread = None
+        self.path = os.path.join(state_path, str(os.getppid()))
+        self.report = {}
+
+    def start(self, load, predict, width):
+        """ Start the warm-up of this worker.
+
+        Args:
+            load: Function loading the model.
+            predict: Function scoring a batch of featurized rows, None to only load the model.
+            width: (int) Number of features of a row.
+        """
+        if self.thread is None:
+            self.thread = get_original('threading', 'Thread')(target=self.run, args=(load, predict, width), daemon=True)
+            self.thread.start()
+
+    def run(self, load, predict, width):
+        start_time = time.perf_counter()
+        try:
+            load()
+        except Exception as e:
+            # Never healthy, like a failing model load on `/ping`
+            print("Model load failed: {}".format(e))
+            return
+        try:
+            for batch_size in batch_sizes if predict is not None else []:
+                rows = get_rows(batch_size, width)
+                times = []
+                for _ in range(rounds):
+                    batch_start = time.perf_counter()
+                    predict(rows)
+                    times.append((time.perf_counter() - batch_start) * 1000)
+                # The first run pays for the tracing, the last one is the warm latency
+                self.report[batch_size] = {'first_ms': times[0], 'warm_ms': times[-1]}
+        except Exception as e:
+            print("Warm-up failed: {}".format(e))
+        self.report['warmup_seconds'] = time.perf_counter() - start_time
+        print("Warm-up Report: {}".format(json.dumps(self.report)))
+
+        os.makedirs(self.path, exist_ok=True)
+        open(os.path.join(self.path, str(os.getpid())), 'w').close()
+        self.done = True
+
+    def is_healthy(self):
+        """ Whether the server is warm: every worker has warmed, or did once.
+        """
+        if os.path.exists(os.path.join(self.path, 'ready')):
+            return True
+        if not self.done:
+            return False
+        workers = int(os.environ.get('MODEL_SERVER_WORKERS', 1))
+        warmed = [name for name in os.listdir(self.path) if name.isdigit() and is_alive(int(name))]
+        if len(warmed) < workers:
+            return False
+        open(os.path.join(self.path, 'ready'), 'w').close()
+        return True
+
+
+# Warm-up of this worker process
+worker = Warmup()
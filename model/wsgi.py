@@ -3,4 +3,7 @@
 # new file.
 
 import app as myapp
-app = myapp.app
\ No newline at end of file
+app = myapp.app
+
+# Warm up each worker before it reports healthy
+myapp.start_warmup()
@@ -0,0 +1,212 @@
+import io
+import copy
+import json
+import time
+import zipfile
+import logging
+import boto3
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+# Pool sized for concurrent calls, adaptive retries back off when throttled
+config = Config(
+    retries={'max_attempts': 10, 'mode': 'adaptive'},
+    max_pool_connections=25
+)
+
+# Seconds a pipeline state is reused before it is fetched again
+state_ttl = 5
+
+_session = None
+_clients = {}
+_states = {}
+_members = {}
+
+# Concurrent requests when deleting model packages, within the client connection pool
+delete_workers = 10
+
+# Bytes read from the end of an archive, enough for the end of central directory
+# record with the longest zip comment
+zip_tail_size = 65536 + 22
+
+
+def get_client(service_name):
+    """ Get a boto3 client, created on first use and reused by warm invocations.
+
+    Args:
+        service_name: (str) AWS service name, e.g. 'codepipeline'.
+
+    Returns: The boto3 client.
+    """
+    global _session
+    if service_name not in _clients:
+        if _session is None:
+            _session = boto3.session.Session()
+        _clients[service_name] = _session.client(service_name, config=config)
+    return _clients[service_name]
+
+
+def get_pipeline_state(pipeline_name, max_age=state_ttl):
+    """ Get the state of a CodePipeline, reusing a recently fetched state.
+
+    Args:
+        pipeline_name: (str) CodePipeline name.
+        max_age: (int) Maximum age in seconds of a cached state, 0 always fetches.
+
+    Returns: The `get_pipeline_state` response.
+    """
+    cached = _states.get(pipeline_name)
+    if cached is None or time.time() - cached[0] >= max_age:
+        try:
+            cached = (time.time(), get_client('codepipeline').get_pipeline_state(name=pipeline_name))
+        except ClientError as e:
+            error_message = e.response["Error"]["Message"]
+            logger.error(error_message)
+            raise Exception(error_message)
+        _states[pipeline_name] = cached
+    return cached[1]
+
+
+def find_execution(pipeline_name, stage_name, action_name, max_age=state_ttl):
+    """ Find the pipeline execution running a stage action.
+
+    Args:
+        pipeline_name: (str) CodePipeline name.
+        stage_name: (str) Name of the pipeline stage.
+        action_name: (str) Name of the action in the stage.
+        max_age: (int) Maximum age in seconds of a cached pipeline state.
+
+    Returns: A tuple of the pipeline execution ID and the latest execution of the
+        action (status, token, ...), or (None, {}) if the action was not found.
+    """
+    response = get_pipeline_state(pipeline_name, max_age=max_age)
+    for stageState in response['stageStates']:
+        if stageState['stageName'] == stage_name:
+            for actionState in stageState['actionStates']:
+                if actionState['actionName'] == action_name:
+                    return stageState['latestExecution']['pipelineExecutionId'], actionState.get('latestExecution', {})
+    return None, {}
+
+
+class S3RangeReader(io.RawIOBase):
+    """ Seekable read-only view of an S3 object that fetches byte ranges on demand.
+
+    The end of the object is fetched once up front, it holds the zip central
+    directory, so `zipfile` only issues ranged GETs for the members it reads.
+    """
+    def __init__(self, s3, bucket, key, size, tail_size=zip_tail_size):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.position = 0
+        self.tail_start = max(0, size - tail_size)
+        self.tail = self.get_range(self.tail_start, size)
+
+    def get_range(self, start, end):
+        """ Fetch the bytes [start, end) of the object.
+        """
+        if start >= end:
+            return b''
+        response = self.s3.get_object(Bucket=self.bucket, Key=self.key,
+                                      Range='bytes={}-{}'.format(start, end - 1))
+        return response['Body'].read()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def readinto(self, buffer):
+        end = min(self.size, self.position + len(buffer))
+        if self.position >= self.tail_start:
+            data = self.tail[self.position - self.tail_start:end - self.tail_start]
+        else:
+            data = self.get_range(self.position, end)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def read_zip_member(bucket, key, name, s3=None):
+    """ Read a JSON file from a zip archive in S3 without downloading the archive.
+
+    Only the central directory and the member are fetched with ranged GETs. The
+    parsed file is cached by the archive ETag, so warm invocations for the same
+    artifact only make a HEAD request.
+
+    Args:
+        bucket: (str) S3 bucket of the archive.
+        key: (str) S3 key of the archive.
+        name: (str) Path of the JSON file in the archive.
+        s3: S3 client, e.g. one pointing to a local S3 endpoint for testing.
+
+    Returns: The parsed JSON file, a copy safe to modify.
+    """
+    s3 = s3 or get_client('s3')
+    head = s3.head_object(Bucket=bucket, Key=key)
+    cache_key = (head['ETag'], name)
+    if cache_key not in _members:
+        reader = io.BufferedReader(S3RangeReader(s3, bucket, key, head['ContentLength']))
+        with zipfile.ZipFile(reader, 'r') as z:
+            if name not in z.namelist():
+                raise Exception("'{}' not found".format(name))
+            _members[cache_key] = json.loads(z.read(name).decode('utf-8'))
+    return copy.deepcopy(_members[cache_key])
+
+
+def list_model_packages(group_name, approval_status=None):
+    """ List the model packages of a group, newest first, one page at a time.
+
+    Args:
+        group_name: (str) Model package group name.
+        approval_status: (str) Only list packages with this approval status, e.g. 'Approved'.
+
+    Yields: Model package summaries.
+    """
+    params = {
+        'ModelPackageGroupName': group_name,
+        'SortBy': 'CreationTime',
+        'SortOrder': 'Descending',
+        'PaginationConfig': {'PageSize': 100}
+    }
+    if approval_status is not None:
+        params['ModelApprovalStatus'] = approval_status
+    paginator = get_client('sagemaker').get_paginator('list_model_packages')
+    for page in paginator.paginate(**params):
+        for model_package in page['ModelPackageSummaryList']:
+            yield model_package
+
+
+def delete_model_packages(group_name, workers=delete_workers):
+    """ Delete every model package of a group, whatever its approval status.
+
+    Deletes run concurrently, the adaptive retry mode of the client backs off
+    when SageMaker throttles the requests.
+
+    Args:
+        group_name: (str) Model package group name.
+        workers: (int) Number of concurrent delete requests.
+
+    Returns: The number of deleted model packages.
+    """
+    sm = get_client('sagemaker')
+    arns = [model_package['ModelPackageArn'] for model_package in list_model_packages(group_name)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda arn: sm.delete_model_package(ModelPackageName=arn), arns))
+    return len(arns)
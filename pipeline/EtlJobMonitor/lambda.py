@@ -1,18 +1,45 @@
-import boto3
-import io
-import json
 import os
 import logging
 from botocore.exceptions import ClientError
-
-glue = boto3.client('glue')
-cw = boto3.client('events')
-cp = boto3.client('codepipeline')
+from mlops_common import get_client, find_execution
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+def get_job_status(event, job_name):
+    """ Get the state of the Glue job run from a state change event, or poll for it.
+
+    Args:
+        event: (dict) Lambda event, a Glue state change event or a scheduled event.
+        job_name: (str) Glue job of the pipeline execution awaiting approval.
+
+    Returns: A tuple of the job run state and error message, or None for events of other jobs.
+    """
+    if event.get('detail-type') == 'Glue Job State Change':
+        if event['detail']['jobName'] != job_name:
+            return None
+        return event['detail']['state'], event['detail'].get('message')
+
+    # Polling fallback for scheduled invocations
+    glue = get_client('glue')
+    response = glue.get_job_runs(JobName=job_name)
+    job_run_id = response['JobRuns'][0]['Id']
+    response = glue.get_job_run(JobName=job_name, RunId=job_run_id)
+    return response['JobRun']['JobRunState'], response['JobRun'].get('ErrorMessage')
+
+
+def disable_polling(model_name):
+    """ Disable the scheduled polling rule once the approval is resolved.
+    """
+    try: 
+        get_client('events').disable_rule(Name="etl-job-monitor-{}".format(model_name))
+    except ClientError as e:
+        error_message = e.response["Error"]["Message"]
+        logger.error(error_message)
+        raise Exception(error_message)
+
+
 def handler(event, context):
     logger.debug("## Environment Variables ##")
     logger.debug(os.environ)
@@ -23,22 +50,21 @@ def handler(event, context):
     result = None
     token = None
     try:
-        response = cp.get_pipeline_state(name=pipeline_name)
-        for stageState in response['stageStates']:
-            if stageState['stageName'] == 'ETLApproval':
-                for actionState in stageState['actionStates']:
-                    if actionState['actionName'] == 'ApproveETL':
-                        latestExecution = actionState['latestExecution']
-                        executionId = stageState['latestExecution']['pipelineExecutionId']
-                        if latestExecution['status'] != 'InProgress':
-                            raise(Exception("ETL approval is not awaiting approval: {}".format(latestExecution['status'])))
-                        token = latestExecution['token']
+        # Approval tokens must be current, the pipeline state is always fetched
+        executionId, latestExecution = find_execution(pipeline_name, 'ETLApproval', 'ApproveETL', max_age=0)
+        if latestExecution.get('status') == 'InProgress':
+            token = latestExecution['token']
         
-        job_name = "bankmarketing-preprocess-{}".format(executionId)
-        response = glue.get_job_runs(JobName=job_name)
-        job_run_id = response['JobRuns'][0]['Id']
-        response = glue.get_job_run(JobName=job_name, RunId=job_run_id)
-        status = response['JobRun']['JobRunState']
+        # The approval was already resolved by the state change event or by polling. The
+        # polling rule is left alone, it is only disabled for the job of this execution
+        if token is None:
+            logger.info("ETL approval is not awaiting approval")
+            return "No approval pending"
+
+        job_status = get_job_status(event, "bankmarketing-preprocess-{}".format(executionId))
+        if job_status is None:
+            return "Event is not for Glue ETL Job of execution ({})".format(executionId)
+        status, error_message = job_status
         logger.info(status)
         
         if status == "SUCCEEDED":
@@ -47,15 +73,12 @@ def handler(event, context):
                 'status': 'Approved'
             }
         
-        elif status == "RUNNING":
-            return "Glue ETL Job ({}) is in progress".format(executionId)
-        
-        elif status == "STARTING":
+        elif status in ["STARTING", "RUNNING", "STOPPING"]:
             return "Glue ETL Job ({}) is in progress".format(executionId)
         
         else:
             result = {
-                'summary': response['JobRun']['ErrorMessage'],
+                'summary': error_message or "Glue ETL Job {}".format(status),
                 'status': 'Rejected'
             }
     except Exception as e:
@@ -66,7 +89,7 @@ def handler(event, context):
         }
     
     try:
-        response = cp.put_approval_result(
+        get_client('codepipeline').put_approval_result(
             pipelineName=pipeline_name,
             stageName='ETLApproval',
             actionName='ApproveETL',
@@ -78,11 +101,6 @@ def handler(event, context):
         logger.error(error_message)
         raise Exception(error_message)
 
-    try: 
-        response = cw.disable_rule(Name="etl-job-monitor-{}".format(model_name))
-    except ClientError as e:
-        error_message = e.response["Error"]["Message"]
-        logger.error(error_message)
-        raise Exception(error_message)
+    disable_polling(model_name)
     
     return "Done!"
\ No newline at end of file
@@ -1,15 +1,9 @@
-import boto3
 import io
 import zipfile
 import json
 import os
 import logging
-
-s3 = boto3.client('s3')
-glue = boto3.client('glue')
-sm = boto3.client('sagemaker')
-cw = boto3.client('events')
-cp = boto3.client('codepipeline')
+from mlops_common import get_client, find_execution
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -30,13 +24,9 @@ def handler(event, context):
         data_bucket = "data-eu-west-1-{}".format(accountId)
         output_bucket = "mlops-eu-west-1-{}".format(model_name)
         etlJob = None
-        response = cp.get_pipeline_state(name=pipeline_name)
-        
-        for stageState in response['stageStates']:
-            if stageState['stageName'] == 'ETL':
-                for actionState in stageState['actionStates']:
-                    if actionState['actionName'] == 'GlueJob':
-                        executionId = stageState['latestExecution']['pipelineExecutionId']
+        s3 = get_client('s3')
+        glue = get_client('glue')
+        executionId, _ = find_execution(pipeline_name, 'ETL', 'GlueJob')
                         
         script_location = "s3://{}/{}/code/preprocess.py".format(output_bucket, executionId)
         job_name = "bankmarketing-preprocess-{}".format(executionId)
@@ -68,12 +58,12 @@ def handler(event, context):
             }
         )['JobRunId']
         logger.info(job_run_id)
-        cw.enable_rule(Name="etl-job-monitor-{}".format(model_name))
-        cp.put_job_success_result(jobId=jobId)
+        get_client('events').enable_rule(Name="etl-job-monitor-{}".format(model_name))
+        get_client('codepipeline').put_job_success_result(jobId=jobId)
     
     except Exception as e:
         logger.error(e)
-        resppnse = cp.put_job_failure_result(
+        resppnse = get_client('codepipeline').put_job_failure_result(
             jobId=jobId,
             failureDetails={
                 'type': 'ConfigurationError',
@@ -5,8 +5,8 @@ import logging
 import urllib3
 import boto3
 from botocore.exceptions import ClientError
+from mlops_common import get_client, delete_model_packages
 
-sm = boto3.client('sagemaker')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 http = urllib3.PoolManager()
@@ -54,7 +54,7 @@ def create(event, context):
     """
     logger.info("Creating model package group: {}".format(group_name))
     try:
-        response = sm.create_model_package_group(
+        response = get_client('sagemaker').create_model_package_group(
             ModelPackageGroupName=group_name,
             ModelPackageGroupDescription='Model Package Group for Production Models.',
             Tags=[
@@ -84,18 +84,11 @@ def delete(event, context):
     """
     logger.info("Deleting model package group: {}".format(group_name))
     try:
-        # Get a list of the model package versions
-        response = sm.list_model_packages(
-            ModelPackageGroupName=group_name,
-            ModelApprovalStatus="Approved",
-            SortBy="CreationTime",
-            MaxResults=100,
-        )
-        # Delete model package versions
-        for model_package in response["ModelPackageSummaryList"]:
-            sm.delete_model_package(ModelPackageName=model_package['ModelPackageArn'])
+        # Delete all model package versions, the group must be empty
+        count = delete_model_packages(group_name)
+        logger.info("Deleted {} model packages".format(count))
         # Delete the package group
-        sm.delete_model_package_group(ModelPackageGroupName=group_name)
+        get_client('sagemaker').delete_model_package_group(ModelPackageGroupName=group_name)
     except ClientError as e:
         error_message = e.response["Error"]["Message"]
         logger.error("Failed to delete model package group: {}".format(error_message))
@@ -1,17 +1,42 @@
-import boto3
-import io
 import os
 import logging
 from botocore.exceptions import ClientError
-
-sm = boto3.client('sagemaker')
-cw = boto3.client('events')
-cp = boto3.client('codepipeline')
+from mlops_common import get_client, find_execution
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+def get_job_status(event, job_name):
+    """ Get the status of the training job from a state change event, or poll for it.
+
+    Args:
+        event: (dict) Lambda event, a SageMaker state change event or a scheduled event.
+        job_name: (str) Training job of the pipeline execution awaiting approval.
+
+    Returns: A tuple of the job status and failure reason, or None for events of other jobs.
+    """
+    if event.get('detail-type') == 'SageMaker Training Job State Change':
+        if event['detail']['TrainingJobName'] != job_name:
+            return None
+        return event['detail']['TrainingJobStatus'], event['detail'].get('FailureReason')
+
+    # Polling fallback for scheduled invocations
+    response = get_client('sagemaker').describe_training_job(TrainingJobName=job_name)
+    return response['TrainingJobStatus'], response.get('FailureReason')
+
+
+def disable_polling(model_name):
+    """ Disable the scheduled polling rule once the approval is resolved.
+    """
+    try:
+        get_client('events').disable_rule(Name="training-job-monitor-{}".format(model_name))
+    except ClientError as e:
+        error_message = e.response["Error"]["Message"]
+        logger.error(error_message)
+        raise Exception(error_message)
+
+
 def handler(event, context):
     logger.debug("## Environment Variables ##")
     logger.debug(os.environ)
@@ -24,23 +49,21 @@ def handler(event, context):
     token = None
     
     try:
-        response = cp.get_pipeline_state(name=pipeline_name)
-        for stageState in response['stageStates']:
-            if stageState['stageName'] == 'TrainApproval':
-                for actionState in stageState['actionStates']:
-                    if actionState['actionName'] == 'ApproveTrain':
-                        latestExecution = actionState['latestExecution']
-                        executionId = stageState['latestExecution']['pipelineExecutionId']
-                        if latestExecution['status'] != 'InProgress':
-                            raise(Exception("Train approval is not awaiting approval: {}".format(latestExecution['status'])))
-                        token = latestExecution['token']
+        # Approval tokens must be current, the pipeline state is always fetched
+        executionId, latestExecution = find_execution(pipeline_name, 'TrainApproval', 'ApproveTrain', max_age=0)
+        if latestExecution.get('status') == 'InProgress':
+            token = latestExecution['token']
         
+        # The approval was already resolved by the state change event or by polling. The
+        # polling rule is left alone, it is only disabled for the job of this execution
         if token is None:
-            raise(Exception("Action token wasn't found. Aborting..."))
-        response = sm.describe_training_job(
-            TrainingJobName="mlops-{}-{}".format(model_name, executionId)
-        )
-        status = response['TrainingJobStatus']
+            logger.info("Train approval is not awaiting approval")
+            return "No approval pending"
+
+        job_status = get_job_status(event, "mlops-{}-{}".format(model_name, executionId))
+        if job_status is None:
+            return "Event is not for training job of execution ({})".format(executionId)
+        status, failure_reason = job_status
         logger.info(status)
         
         if status == "Completed":
@@ -48,12 +71,12 @@ def handler(event, context):
                 'summary': 'Model trained successfully',
                 'status': 'Approved'
             }
-        elif status == "InProgress":
+        elif status in ["InProgress", "Stopping"]:
             return "Training Job ({}) in progress".format(executionId)
             
         else:
             result = {
-                'summary': response['FailureReason'],
+                'summary': failure_reason or "Training job {}".format(status),
                 'status': 'Rejected'
             }
     except Exception as e:
@@ -63,7 +86,7 @@ def handler(event, context):
         }
     
     try:
-        response = cp.put_approval_result(
+        get_client('codepipeline').put_approval_result(
             pipelineName=pipeline_name,
             stageName='TrainApproval',
             actionName='ApproveTrain',
@@ -74,11 +97,6 @@ def handler(event, context):
         logger.error(error_message)
         raise Exception(error_message)
 
-    try:
-        response = cw.disable_rule(Name="training-job-monitor-{}".format(model_name))
-    except ClientError as e:
-        error_message = e.response["Error"]["Message"]
-        logger.error(error_message)
-        raise Exception(error_message)
+    disable_polling(model_name)
     
     return "Done!"
\ No newline at end of file
@@ -1,20 +1,10 @@
-import boto3
-import io
-import zipfile
-import json
 import os
 import logging
+from mlops_common import get_client, find_execution, read_zip_member
 
-s3 = boto3.client('s3')
-sm = boto3.client('sagemaker')
-cw = boto3.client('events')
-cp = boto3.client('codepipeline')
-sts = boto3.client('sts')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-ACCOUNTID = sts.get_caller_identity()['Account']
-
 def handler(event, context):
     logger.debug("## Environment Variables ##")
     logger.info(os.environ)
@@ -29,41 +19,43 @@ def handler(event, context):
     pipeline_bucket = "mlops-eu-west-1-{}".format(model_name)
     
     try:
-        response = cp.get_pipeline_state(name=pipeline_name)
-        for stageState in response['stageStates']:
-            if stageState['stageName'] == 'Train':
-                for actionState in stageState['actionStates']:
-                    if actionState['actionName'] == 'TrainModel':
-                        executionId = stageState['latestExecution']['pipelineExecutionId']
+        executionId, _ = find_execution(pipeline_name, 'Train', 'TrainModel')
                         
         logger.info("Start training job for 'jobid[{}]' and 'executionId[{}]'".format(jobId, executionId))
         
         for inputArtifacts in event["CodePipeline.job"]["data"]["inputArtifacts"]:
             if inputArtifacts['name'] == 'ModelSourceOutput':
                 s3Location = inputArtifacts['location']['s3Location']
-                zip_bytes = s3.get_object(Bucket=s3Location['bucketName'], Key=s3Location['objectKey'])['Body'].read()
-                with zipfile.ZipFile(io.BytesIO(zip_bytes), "r") as z:
-                    trainingJob = json.loads(z.read('trainingjob.json').decode('ascii'))
+                # Fetch only the central directory and the job template, not the whole source artifact
+                trainingJob = read_zip_member(s3Location['bucketName'], s3Location['objectKey'], 'trainingjob.json')
         
         if trainingJob is None:
             raise(Exception("'trainingjob.json' not found"))
         
-        trainingJob['AlgorithmSpecification']['TrainingImage'] = "{}.dkr.ecr.eu-west-1.amazonaws.com/bankmarketing-{}:latest".format(ACCOUNTID, model_name)
-        trainingJob['RoleArn'] = "arn:aws:iam::{}:role/{}".format(ACCOUNTID, model_name)
+        trainingJob['AlgorithmSpecification']['TrainingImage'] = "{}.dkr.ecr.eu-west-1.amazonaws.com/bankmarketing-{}:latest".format(accountId, model_name)
+        trainingJob['RoleArn'] = "arn:aws:iam::{}:role/{}".format(accountId, model_name)
         
         trainingJob['TrainingJobName'] = "mlops-{}-{}".format(model_name, executionId)
         trainingJob['OutputDataConfig']['S3OutputPath'] = os.path.join('s3://', pipeline_bucket, executionId)
-        trainingJob['InputDataConfig'][0]['DataSource']['S3DataSource']['S3Uri'] = os.path.join('s3://', pipeline_bucket, executionId, 'input/training')
+        for channel in trainingJob['InputDataConfig']:
+            if channel['ChannelName'] == 'training':
+                channel['DataSource']['S3DataSource']['S3Uri'] = os.path.join('s3://', pipeline_bucket, executionId, 'input/training')
+            # Optional replicated validation channel for training channels sharded by S3 key
+            elif channel['ChannelName'] == 'validation':
+                channel['DataSource']['S3DataSource']['S3Uri'] = os.path.join('s3://', pipeline_bucket, executionId, 'input/training/validate')
+        # Checkpoints of this execution, restored when a spot training job is interrupted
+        if 'CheckpointConfig' in trainingJob:
+            trainingJob['CheckpointConfig']['S3Uri'] = os.path.join('s3://', pipeline_bucket, executionId, 'checkpoints')
         trainingJob['Tags'].append({'Key': 'jobid', 'Value': jobId})
         
         logger.info(trainingJob)
-        sm.create_training_job(**trainingJob)
-        cw.enable_rule(Name="training-job-monitor-{}".format(model_name))
-        cp.put_job_success_result(jobId=jobId)
+        get_client('sagemaker').create_training_job(**trainingJob)
+        get_client('events').enable_rule(Name="training-job-monitor-{}".format(model_name))
+        get_client('codepipeline').put_job_success_result(jobId=jobId)
         
     except Exception as e:
         logger.error(e)
-        response = cp.put_job_failure_result(
+        get_client('codepipeline').put_job_failure_result(
             jobId=jobId,
             failureDetails={
                 'type': 'ConfigurationError',
@@ -4,17 +4,20 @@ import json
 import logging
 import boto3
 import time
-import botocore
 import numpy as np
 import pandas as pd
-from sklearn import preprocessing
 from sklearn.metrics import mean_squared_error
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-s3 = boto3.client("s3")
-sm_client = boto3.client("sagemaker-runtime")
+
+# Same client settings as the pipeline layer (pipeline/Common), which this stack
+# is deployed without: adaptive retries back off when the endpoint throttles
+config = Config(retries={'max_attempts': 10, 'mode': 'adaptive'})
+s3 = boto3.client("s3", config=config)
+sm_client = boto3.client("sagemaker-runtime", config=config)
 
 
 def evaluate_model(bucket, key, endpoint_name):
@@ -50,8 +53,8 @@ def evaluate_model(bucket, key, endpoint_name):
     obj = s3.get_object(Bucket=bucket, Key=key)
     test_df = pd.read_csv(io.BytesIO(obj['Body'].read()), names=column_names)
     y = test_df['y_yes'].to_numpy()
+    # Normalization is applied by the serving container
     X = test_df.drop(['y_yes'], axis=1).to_numpy()
-    X = preprocessing.normalize(X)
     
     # Cycle through each row of the data to get a prediction
     for row in range(len(X)):
@@ -2,10 +2,12 @@ import json
 import os
 import logging
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
-
-sm = boto3.client('sagemaker')
+# Same client settings as the pipeline layer (pipeline/Common), which this stack
+# is deployed without: adaptive retries back off when SageMaker throttles
+sm = boto3.client('sagemaker', config=Config(retries={'max_attempts': 10, 'mode': 'adaptive'}))
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
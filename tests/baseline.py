@@ -0,0 +1,610 @@
+import argparse
+import base64
+import io
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# KLL sketch parameters reported in `statistics.json`, like the Model Monitor analyzer
+sketch_k = 2048
+sketch_c = 0.64
+
+# Number of equal-width buckets of the numerical distributions
+num_buckets = 10
+
+# Columns with more distinct values are not tracked as categorical distributions
+max_categories = 100
+
+# Rows read per chunk when streaming a dataset
+chunk_size = 100000
+
+# Data capture files of SageMaker and capture batches of the serving container
+capture_suffixes = ('.jsonl', '.npz')
+
+# Default monitoring configuration of suggested constraints
+monitoring_config = {
+    "evaluate_constraints": "Enabled",
+    "emit_metrics": "Enabled",
+    "datatype_check_threshold": 1.0,
+    "domain_content_threshold": 1.0,
+    "distribution_constraints": {
+        "perform_comparison": "Enabled",
+        "comparison_threshold": 0.1,
+        "comparison_method": "Robust"
+    }
+}
+
+
+def split_s3_uri(uri):
+    """ Split an S3 URI into bucket and key.
+
+    Args:
+        uri: (str) S3 URI, e.g. 's3://bucket/prefix'.
+
+    Returns: A tuple of the bucket and key.
+    """
+    bucket, _, key = uri[len('s3://'):].partition('/')
+    return bucket, key
+
+
+def list_files(uri, suffixes):
+    """ List the files of a local path or S3 prefix, recursively and in order.
+
+    Args:
+        uri: (str) Local file or directory, or S3 URI.
+        suffixes: (tuple) File name suffixes to list.
+
+    Returns: Sorted list of file paths or S3 URIs.
+    """
+    if uri.startswith('s3://'):
+        import boto3
+        bucket, prefix = split_s3_uri(uri)
+        paginator = boto3.client('s3').get_paginator('list_objects_v2')
+        keys = []
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            keys.extend(obj['Key'] for obj in page.get('Contents', []) if obj['Key'].endswith(suffixes))
+        return ['s3://{}/{}'.format(bucket, key) for key in sorted(keys)]
+
+    if os.path.isdir(uri):
+        return sorted(os.path.join(root, name) for root, _, names in os.walk(uri)
+                      for name in names if name.endswith(suffixes))
+    return [uri] if uri.endswith(suffixes) else []
+
+
+def open_file(uri):
+    """ Open a local file or S3 object for reading.
+
+    Returns: A binary file-like object.
+    """
+    if uri.startswith('s3://'):
+        import boto3
+        bucket, key = split_s3_uri(uri)
+        return io.BytesIO(boto3.client('s3').get_object(Bucket=bucket, Key=key)['Body'].read())
+    return open(uri, 'rb')
+
+
+def write_json(uri, name, body):
+    """ Write a JSON report to a local directory or S3 prefix.
+    """
+    data = json.dumps(body, indent=4)
+    if uri.startswith('s3://'):
+        import boto3
+        bucket, prefix = split_s3_uri(uri.rstrip('/'))
+        boto3.client('s3').put_object(Bucket=bucket, Key='{}/{}'.format(prefix, name), Body=data.encode('utf-8'))
+    else:
+        os.makedirs(uri, exist_ok=True)
+        with open(os.path.join(uri, name), 'w') as f:
+            f.write(data)
+
+
+def read_json(uri, name):
+    """ Read a JSON report from a local directory or S3 prefix.
+    """
+    with open_file(uri.rstrip('/') + '/' + name) as f:
+        return json.load(f)
+
+
+def read_csv(uri, header=True):
+    """ Stream the rows of CSV files in chunks.
+
+    Args:
+        uri: (str) Local file or directory, or S3 prefix of CSV files.
+        header: (bool) Whether the files start with a header row.
+
+    Yields: DataFrames of at most `chunk_size` rows.
+    """
+    for source in list_files(uri, ('.csv',)):
+        with open_file(source) as f:
+            for frame in pd.read_csv(f, header=0 if header else None, dtype=str, chunksize=chunk_size):
+                if header:
+                    # `np.savetxt` headers start with '# ' and keep the line continuation indents
+                    frame.columns = [str(name).strip().lstrip('#').strip() for name in frame.columns]
+                yield frame
+
+
+def decode_capture(capture):
+    """ Decode the CSV payload of a captured request or response.
+    """
+    if capture['encoding'] == 'BASE64':
+        return base64.b64decode(capture['data']).decode('utf-8')
+    return capture['data']
+
+
+def parse_capture(lines, dtype=str):
+    """ Parse data capture records into rows of the output columns followed by
+    the input columns, the layout of the baseline dataset.
+
+    The CSV payloads of all records are parsed in one call. Records whose
+    request and response row counts differ are skipped.
+
+    Args:
+        lines: (list) Data capture JSON lines.
+        dtype: Column type, strings by default or e.g. float.
+
+    Returns: A DataFrame of the captured rows, or None if there are none.
+    """
+    inputs, outputs = [], []
+    for line in lines:
+        if not line.strip():
+            continue
+        capture = json.loads(line)['captureData']
+        request = decode_capture(capture['endpointInput']).strip()
+        response = decode_capture(capture['endpointOutput']).strip()
+        if request and request.count('\n') == response.count('\n'):
+            inputs.append(request)
+            outputs.append(response)
+    if not inputs:
+        return None
+
+    frame = pd.concat([
+        pd.read_csv(io.StringIO('\n'.join(outputs)), header=None, dtype=dtype),
+        pd.read_csv(io.StringIO('\n'.join(inputs)), header=None, dtype=dtype)
+    ], axis=1)
+    frame.columns = ['_c{}'.format(i) for i in range(frame.shape[1])]
+    return frame
+
+
+def parse_capture_batch(columns, dtype=str):
+    """ Parse a capture batch of the serving container (see `model/capture.py`)
+    into rows of the prediction followed by the input columns, like `parse_capture`.
+
+    Only the sampled rows are kept, errors and outliers are captured whatever
+    the sampling and would skew the distributions.
+
+    Args:
+        columns: (dict) Columns of the batch, e.g. loaded with `np.load`.
+        dtype: Column type, strings by default or e.g. float.
+
+    Returns: A DataFrame of the captured rows, or None if there are none.
+    """
+    keep = (columns['status'] == 200) & (columns['reason'] == 'sampled')
+    if not keep.any():
+        return None
+    inputs = columns['inputs'][keep]
+    if inputs.ndim == 1:
+        # Rows of different widths are stored as CSV lines
+        inputs = pd.read_csv(io.StringIO('\n'.join(inputs)), header=None, dtype=dtype)
+    else:
+        inputs = pd.DataFrame(inputs).astype(dtype)
+    frame = pd.concat([pd.DataFrame(columns['predictions'][keep]).astype(dtype), inputs], axis=1)
+    frame.columns = ['_c{}'.format(i) for i in range(frame.shape[1])]
+    return frame
+
+
+def load_capture_batch(source):
+    """ Read the columns of a `.npz` capture batch from a local file or S3.
+    """
+    with open_file(source) as f:
+        with np.load(io.BytesIO(f.read())) as batch:
+            return {name: batch[name] for name in batch.files}
+
+
+def read_capture(uri):
+    """ Stream captured endpoint traffic, see `parse_capture` and `parse_capture_batch`.
+
+    Args:
+        uri: (str) Local directory or S3 prefix of data capture `.jsonl` files
+            or capture batches `.npz` of the serving container.
+
+    Yields: DataFrames of the captured rows, one per capture file.
+    """
+    for source in list_files(uri, capture_suffixes):
+        if source.endswith('.npz'):
+            frame = parse_capture_batch(load_capture_batch(source))
+        else:
+            with open_file(source) as f:
+                frame = parse_capture(f.read().decode('utf-8').splitlines())
+        if frame is not None:
+            yield frame
+
+
+class QuantileSketch(object):
+    """ Mergeable KLL-style quantile sketch of a numeric column.
+
+    Level `i` holds items standing for `2 ** i` values. A full level is sorted
+    and every other item, from a random offset, is promoted to the next level.
+    """
+    def __init__(self, k=sketch_k, seed=0):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.rng = np.random.RandomState(seed)
+
+    def update(self, values):
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.compact()
+
+    def merge(self, other):
+        """ Add the items of another sketch, level by level.
+        """
+        for i, level in enumerate(other.levels):
+            if i == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[i] = np.concatenate([self.levels[i], level])
+        self.compact()
+
+    def compact(self):
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self.k:
+                items = np.sort(self.levels[level])
+                # An odd item out stays on its level
+                if len(items) % 2:
+                    items, self.levels[level] = items[:-1], items[-1:]
+                else:
+                    self.levels[level] = np.empty(0)
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                offset = self.rng.randint(2)
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], items[offset::2]])
+            level += 1
+
+    def weighted_items(self):
+        """ Sorted items with their weights.
+        """
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2.0 ** i) for i, level in enumerate(self.levels)])
+        order = np.argsort(items, kind='mergesort')
+        return items[order], weights[order]
+
+    def cdf(self, points):
+        """ Estimated fraction of values less than or equal to each point.
+        """
+        items, weights = self.weighted_items()
+        if len(items) == 0:
+            return np.zeros(len(points))
+        cumulative = np.concatenate([[0.0], np.cumsum(weights)])
+        return cumulative[np.searchsorted(items, points, side='right')] / cumulative[-1]
+
+    def quantile(self, fractions):
+        """ Estimated values at each fraction of the distribution.
+        """
+        items, weights = self.weighted_items()
+        cumulative = np.cumsum(weights)
+        index = np.searchsorted(cumulative, np.asarray(fractions) * cumulative[-1], side='left')
+        return items[np.minimum(index, len(items) - 1)]
+
+    def to_dict(self):
+        return {
+            "parameters": {"c": sketch_c, "k": float(self.k)},
+            "data": [level.tolist() for level in self.levels]
+        }
+
+    @classmethod
+    def from_dict(cls, sketch):
+        result = cls(k=int(sketch['parameters']['k']))
+        result.levels = [np.asarray(level, dtype=float) for level in sketch['data']] or [np.empty(0)]
+        return result
+
+
+class DatasetStatistics(object):
+    """ Per-column statistics of a dataset accumulated over chunks in a single pass.
+
+    Counts, sums, means, variances (merged with Chan's formula), minimum and
+    maximum are computed for all columns at once on each chunk.
+    """
+    def __init__(self):
+        self.names = None
+        self.item_count = 0
+
+    def start(self, names):
+        n = len(names)
+        self.names = list(names)
+        self.num_present = np.zeros(n)
+        self.num_numeric = np.zeros(n)
+        self.num_integral = np.zeros(n)
+        self.mean = np.zeros(n)
+        self.m2 = np.zeros(n)
+        self.sum = np.zeros(n)
+        self.min = np.full(n, np.inf)
+        self.max = np.full(n, -np.inf)
+        self.sketches = [QuantileSketch() for _ in names]
+        self.categories = [pd.Series(dtype=float) for _ in names]
+
+    def update(self, frame):
+        """ Add a chunk of rows, all columns as strings.
+        """
+        if self.names is None:
+            self.start(frame.columns)
+        elif len(frame.columns) != len(self.names):
+            raise ValueError("Expected {} columns, got {}".format(len(self.names), len(frame.columns)))
+
+        self.item_count += len(frame)
+        present = frame.notna().to_numpy()
+        values = frame.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+        numeric = ~np.isnan(values)
+
+        self.num_present += present.sum(axis=0)
+        count = numeric.sum(axis=0)
+        self.num_integral += (numeric & (np.mod(np.nan_to_num(values), 1) == 0)).sum(axis=0)
+
+        # Merge the chunk mean and sum of squared deviations into the running ones
+        with np.errstate(invalid='ignore', divide='ignore'):
+            chunk_sum = np.nansum(values, axis=0)
+            chunk_mean = np.where(count > 0, chunk_sum / count, 0.0)
+            chunk_m2 = np.nansum((values - chunk_mean) ** 2, axis=0)
+            total = self.num_numeric + count
+            delta = chunk_mean - self.mean
+            self.mean = np.where(total > 0, self.mean + delta * count / total, 0.0)
+            self.m2 = np.where(total > 0, self.m2 + chunk_m2 + delta ** 2 * self.num_numeric * count / total, 0.0)
+        self.num_numeric = total
+        self.sum += chunk_sum
+        if numeric.any():
+            self.min = np.fmin(self.min, np.nanmin(np.where(numeric, values, np.inf), axis=0))
+            self.max = np.fmax(self.max, np.nanmax(np.where(numeric, values, -np.inf), axis=0))
+
+        for i in range(len(self.names)):
+            if count[i] > 0:
+                self.sketches[i].update(values[numeric[:, i], i])
+            if self.categories[i] is not None:
+                counts = frame.iloc[:, i].value_counts()
+                self.categories[i] = self.categories[i].add(counts, fill_value=0)
+                if len(self.categories[i]) > max_categories:
+                    self.categories[i] = None
+
+    def inferred_type(self, i):
+        """ Model Monitor data type of a column.
+        """
+        if self.num_present[i] > 0 and self.num_numeric[i] == self.num_present[i]:
+            return "Integral" if self.num_integral[i] == self.num_numeric[i] else "Fractional"
+        return "String"
+
+    def to_dict(self):
+        """ Statistics in the Model Monitor `statistics.json` format.
+        """
+        features = []
+        for i, name in enumerate(self.names):
+            common = {
+                "num_present": int(self.num_present[i]),
+                "num_missing": int(self.item_count - self.num_present[i])
+            }
+            feature = {"name": name, "inferred_type": self.inferred_type(i)}
+            if feature["inferred_type"] == "String":
+                categories = self.categories[i] if self.categories[i] is not None else pd.Series(dtype=float)
+                feature["string_statistics"] = {
+                    "common": common,
+                    "distinct_count": float(len(categories)),
+                    "distribution": {"categorical": {"buckets": [
+                        {"value": value, "count": int(count)} for value, count in categories.items()
+                    ]}}
+                }
+            else:
+                edges = np.linspace(self.min[i], self.max[i], num_buckets + 1)
+                counts = np.diff(np.concatenate([[0.0], self.sketches[i].cdf(edges[1:])])) * self.num_numeric[i]
+                feature["numerical_statistics"] = {
+                    "common": common,
+                    "mean": float(self.mean[i]),
+                    "sum": float(self.sum[i]),
+                    "std_dev": float(np.sqrt(self.m2[i] / self.num_numeric[i])),
+                    "min": float(self.min[i]),
+                    "max": float(self.max[i]),
+                    "distribution": {"kll": {
+                        "buckets": [{"lower_bound": float(lower), "upper_bound": float(upper), "count": float(count)}
+                                    for lower, upper, count in zip(edges[:-1], edges[1:], counts)],
+                        "sketch": self.sketches[i].to_dict()
+                    }}
+                }
+            features.append(feature)
+        return {"version": 0.0, "dataset": {"item_count": self.item_count}, "features": features}
+
+
+def compute_statistics(frames):
+    """ Compute the statistics of a dataset in a single streaming pass.
+
+    Args:
+        frames: (iterable) DataFrames of rows, all columns as strings.
+
+    Returns: The statistics in the `statistics.json` format.
+    """
+    statistics = DatasetStatistics()
+    for frame in frames:
+        statistics.update(frame)
+    if statistics.names is None:
+        raise ValueError("Dataset is empty")
+    return statistics.to_dict()
+
+
+def suggest_constraints(statistics):
+    """ Suggest constraints from baseline statistics, like the Model Monitor analyzer.
+
+    Args:
+        statistics: (dict) Baseline statistics.
+
+    Returns: The constraints in the `constraints.json` format.
+    """
+    item_count = statistics["dataset"]["item_count"]
+    features = []
+    for feature in statistics["features"]:
+        stats = feature.get("numerical_statistics") or feature.get("string_statistics")
+        constraint = {
+            "name": feature["name"],
+            "inferred_type": feature["inferred_type"],
+            "completeness": stats["common"]["num_present"] / item_count
+        }
+        if "numerical_statistics" in feature:
+            constraint["num_constraints"] = {"is_non_negative": stats["min"] >= 0}
+        elif stats["distribution"]["categorical"]["buckets"]:
+            constraint["string_constraints"] = {
+                "domains": [bucket["value"] for bucket in stats["distribution"]["categorical"]["buckets"]]
+            }
+        features.append(constraint)
+    return {"version": 0.0, "features": features, "monitoring_config": monitoring_config}
+
+
+def get_distance(baseline, current):
+    """ Maximum distance between the baseline and current distributions of a feature,
+    between the CDFs of numerical features or the frequencies of categorical ones.
+    """
+    if "numerical_statistics" in baseline:
+        base = QuantileSketch.from_dict(baseline["numerical_statistics"]["distribution"]["kll"]["sketch"])
+        cur = QuantileSketch.from_dict(current["numerical_statistics"]["distribution"]["kll"]["sketch"])
+        points = np.union1d(base.weighted_items()[0], cur.weighted_items()[0])
+        return float(np.max(np.abs(base.cdf(points) - cur.cdf(points)))) if len(points) else 0.0
+
+    def frequencies(feature):
+        buckets = feature["string_statistics"]["distribution"]["categorical"]["buckets"]
+        total = sum(bucket["count"] for bucket in buckets) or 1
+        return {bucket["value"]: bucket["count"] / total for bucket in buckets}
+    base, cur = frequencies(baseline), frequencies(current)
+    return max([abs(base.get(value, 0.0) - cur.get(value, 0.0)) for value in set(base) | set(cur)] or [0.0])
+
+
+def check_constraints(baseline_statistics, constraints, statistics):
+    """ Compare the statistics of a dataset with the baseline constraints.
+
+    Columns are matched by position, captured traffic has no column names.
+
+    Args:
+        baseline_statistics: (dict) Baseline statistics.
+        constraints: (dict) Baseline constraints.
+        statistics: (dict) Statistics of the dataset to check.
+
+    Returns: The violations in the `constraint_violations.json` format.
+    """
+    config = constraints.get("monitoring_config", monitoring_config)
+    distribution = config.get("distribution_constraints", {})
+    violations = []
+
+    def violation(name, check_type, description):
+        violations.append({"feature_name": name, "constraint_check_type": check_type, "description": description})
+
+    expected, observed = len(constraints["features"]), len(statistics["features"])
+    if observed < expected:
+        violation("", "missing_column_check",
+                  "There are missing columns in current dataset. Number of columns in current dataset: {}, "
+                  "Number of columns in baseline constraints: {}".format(observed, expected))
+    elif observed > expected:
+        violation("", "extra_column_check",
+                  "There are extra columns in current dataset. Number of columns in current dataset: {}, "
+                  "Number of columns in baseline constraints: {}".format(observed, expected))
+
+    item_count = statistics["dataset"]["item_count"]
+    for constraint, baseline, current in zip(constraints["features"], baseline_statistics["features"], statistics["features"]):
+        name = constraint["name"]
+        stats = current.get("numerical_statistics") or current.get("string_statistics")
+
+        completeness = stats["common"]["num_present"] / item_count if item_count else 0.0
+        if completeness < constraint["completeness"]:
+            violation(name, "completeness_check",
+                      "Data completeness is below the baseline. Expected: {:.2%}, Observed: {:.2%}".format(
+                          constraint["completeness"], completeness))
+
+        if constraint["inferred_type"] != "String" and current["inferred_type"] == "String" or \
+                constraint["inferred_type"] == "Integral" and current["inferred_type"] == "Fractional":
+            violation(name, "data_type_check",
+                      "Data type match requirement is not met. Expected data type: {}, Expected match: {:.1%}. "
+                      "Observed: data is {}.".format(constraint["inferred_type"], config["datatype_check_threshold"],
+                                                      current["inferred_type"]))
+            continue
+
+        if constraint.get("num_constraints", {}).get("is_non_negative") and stats["min"] < 0:
+            violation(name, "negative_values_check",
+                      "Feature has negative values, the baseline is non-negative. Observed min: {}".format(stats["min"]))
+
+        if "string_constraints" in constraint and "string_statistics" in current:
+            domains = set(constraint["string_constraints"]["domains"])
+            buckets = current["string_statistics"]["distribution"]["categorical"]["buckets"]
+            total = sum(bucket["count"] for bucket in buckets)
+            matched = sum(bucket["count"] for bucket in buckets if bucket["value"] in domains)
+            if total and matched / total < config["domain_content_threshold"]:
+                violation(name, "categorical_values_check",
+                          "Value(s) not in the baseline domain. Expected match: {:.1%}, Observed: {:.1%}".format(
+                              config["domain_content_threshold"], matched / total))
+
+        if distribution.get("perform_comparison") == "Enabled" and \
+                ("numerical_statistics" in baseline) == ("numerical_statistics" in current):
+            distance = get_distance(baseline, current)
+            if distance > distribution["comparison_threshold"]:
+                violation(name, "baseline_drift_check",
+                          "Baseline drift distance: {:.4f} exceeds threshold: {}".format(
+                              distance, distribution["comparison_threshold"]))
+
+    return {"violations": violations}
+
+
+def suggest(dataset_uri, output_uri):
+    """ Write `statistics.json` and `constraints.json` for a baseline dataset.
+
+    Args:
+        dataset_uri: (str) Baseline CSV file, directory or S3 prefix, with a header row.
+        output_uri: (str) Output directory or S3 prefix.
+
+    Returns: A tuple of the statistics and constraints.
+    """
+    statistics = compute_statistics(read_csv(dataset_uri, header=True))
+    constraints = suggest_constraints(statistics)
+    write_json(output_uri, "statistics.json", statistics)
+    write_json(output_uri, "constraints.json", constraints)
+    logger.info("Baseline of {} rows written to {}".format(statistics["dataset"]["item_count"], output_uri))
+    return statistics, constraints
+
+
+def check(baseline_uri, dataset_uri, output_uri):
+    """ Check a dataset, or captured endpoint traffic, against the baseline and
+    write its `statistics.json` and `constraint_violations.json`.
+
+    Args:
+        baseline_uri: (str) Directory or S3 prefix of the baseline reports.
+        dataset_uri: (str) Data capture `.jsonl` or `.npz` files, or a CSV dataset without header.
+        output_uri: (str) Output directory or S3 prefix.
+
+    Returns: The constraint violations.
+    """
+    if list_files(dataset_uri, capture_suffixes):
+        frames = read_capture(dataset_uri)
+    else:
+        frames = read_csv(dataset_uri, header=False)
+    statistics = compute_statistics(frames)
+    violations = check_constraints(read_json(baseline_uri, "statistics.json"),
+                                   read_json(baseline_uri, "constraints.json"), statistics)
+    write_json(output_uri, "statistics.json", statistics)
+    write_json(output_uri, "constraint_violations.json", violations)
+    logger.info("Found {} constraint violations".format(len(violations["violations"])))
+    return violations
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    suggest_parser = subparsers.add_parser("suggest", help="Suggest baseline statistics and constraints")
+    suggest_parser.add_argument("dataset", type=str, help="Baseline CSV file, directory or S3 prefix")
+    suggest_parser.add_argument("output", type=str, help="Output directory or S3 prefix")
+    check_parser = subparsers.add_parser("check", help="Check a dataset against the baseline constraints")
+    check_parser.add_argument("baseline", type=str, help="Directory or S3 prefix of the baseline reports")
+    check_parser.add_argument("dataset", type=str, help="Data capture files or CSV dataset, directory or S3 prefix")
+    check_parser.add_argument("output", type=str, help="Output directory or S3 prefix")
+    check_parser.add_argument("--fail-on-violation", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(levelname)s: [%(filename)s:%(lineno)s] %(message)s",
+                        level=os.environ.get("LOGLEVEL", "INFO").upper())
+
+    if args.command == "suggest":
+        suggest(args.dataset, args.output)
+    else:
+        violations = check(args.baseline, args.dataset, args.output)
+        if args.fail_on_violation and violations["violations"]:
+            raise SystemExit(1)
@@ -4,6 +4,7 @@ import boto3
 import argparse
 import json
 import time
+import hashlib
 from botocore.exceptions import ClientError
 
 # Step Functions Libraries
@@ -21,16 +22,17 @@ from stepfunctions.workflow import Workflow
 import sagemaker
 from sagemaker.processing import ProcessingInput, ProcessingOutput, Processor
 
+import baseline
+
 # Client Session
 logger = logging.getLogger(__name__)
-sagemaker_session = sagemaker.Session()
-region = sagemaker_session.boto_region_name
-account_id = boto3.client('sts').get_caller_identity()["Account"]
-role = sagemaker.session.get_execution_role()
 sfn = boto3.client('stepfunctions')
 cp = boto3.client('codepipeline')
 ssm = boto3.client('ssm')
 
+# Seconds to wait for an updated State Machine definition to be visible
+update_timeout = 120
+
 # Helper Functions
 def get_job_id(pipeline_name):
     """ Gets the current executionId based on the CodePipeline Stage.
@@ -131,69 +133,106 @@ def get_baseline_uri(region):
     
     return container_uri
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--pipeline-name", type=str, default=os.environ["PIPELINE_NAME"])
-    parser.add_argument("--image-repo-name", type=str, default=os.environ["IMAGE_REPO_NAME"])
-    parser.add_argument("--image-tag", type=str, default=os.environ["IMAGE_TAG"])
-    parser.add_argument("--model-name", type=str, default=os.environ["MODEL_NAME"])
-    parser.add_argument("--model-package-group-name", type=str, default=os.environ["MODEL_GROUP"])
-    parser.add_argument("--test-endpoint", type=str, default="{}-dev-endpoint".format(os.environ["MODEL_NAME"]))
-    parser.add_argument("--pipeline-bucket", type=str, default=os.environ["PIPELINE_BUCKET"])
-    args, _ = parser.parse_known_args()
+def get_definition_fingerprint(definition, role_arn):
+    """ Fingerprint of a State Machine definition and execution role.
 
-    # Configure logging to output the line number and message
-    log_format = "%(levelname)s: [%(filename)s:%(lineno)s] %(message)s"
-    logging.basicConfig(format=log_format, level=os.environ.get("LOGLEVEL", "INFO").upper())
+    Args:
+        definition: (str) Amazon States Language JSON definition.
+        role_arn: (str) Workflow execution role ARN.
 
-    # Configure workflow variables for current execution
-    job_id = get_job_id(args.pipeline_name)
-    baseline_job_name = "{}-baseline-{}".format(args.model_name, job_id[-12:])
-    image_uri = "{}.dkr.ecr.{}.amazonaws.com/{}:{}".format(account_id, region, args.image_repo_name, args.image_tag)
+    Returns: SHA-256 hex digest, independent of the JSON formatting.
+    """
+    canonical = json.dumps({'definition': json.loads(definition), 'role': role_arn}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
 
+
+def wait_for_update(state_machine_arn, fingerprint, revision_id=None):
+    """ Poll the State Machine with backoff until it serves the updated definition.
+
+    Args:
+        state_machine_arn: (str) State Machine ARN.
+        fingerprint: (str) Fingerprint of the updated definition.
+        revision_id: (str) Revision returned by the update, when the API provides one.
     """
-    SageMaker expects unique names for each job, model and endpoint.
+    delay = 1
+    deadline = time.time() + update_timeout
+    while True:
+        response = sfn.describe_state_machine(stateMachineArn=state_machine_arn)
+        if response['status'] == 'ACTIVE' and \
+                get_definition_fingerprint(response['definition'], response['roleArn']) == fingerprint and \
+                (revision_id is None or response.get('revisionId') == revision_id):
+            return
+        if time.time() + delay > deadline:
+            raise Exception("State Machine definition not updated after {} seconds".format(update_timeout))
+        logger.info("Waiting {} seconds for the State Machine definition to update ...".format(delay))
+        time.sleep(delay)
+        delay = min(delay * 2, 16)
+
+
+def deploy_workflow(workflow):
+    """ Create the State Machine, or update it only when its definition changed.
 
-    NOTE: If these names are not unique the execution will fail.
-          Pass these dynamically for each execution using placeholders.
+    Args:
+        workflow: (Workflow) System Test workflow.
+
+    Returns: The State Machine ARN.
     """
-    execution_input = ExecutionInput(
-        schema={
-            "ModelName": str,
-            "ModelGroup": str,
-            "EndpointName": str,
-            "BaselineProcessingJobName": str
-        }
+    state_machine_arn = "arn:aws:states:{}:{}:stateMachine:{}".format(region, account_id, workflow.name)
+    definition = workflow.definition.to_json()
+    fingerprint = get_definition_fingerprint(definition, workflow.role)
+
+    try:
+        response = sfn.describe_state_machine(stateMachineArn=state_machine_arn)
+    except sfn.exceptions.StateMachineDoesNotExist:
+        logger.info("Creating workflow ...")
+        return workflow.create()
+
+    if get_definition_fingerprint(response['definition'], response['roleArn']) == fingerprint:
+        logger.info("Workflow definition unchanged ({}), skipping update".format(fingerprint[:12]))
+        return state_machine_arn
+
+    logger.info("Found existing workflow, updating the State Machine definition ...")
+    response = sfn.update_state_machine(
+        stateMachineArn=state_machine_arn,
+        definition=definition,
+        roleArn=workflow.role
     )
+    wait_for_update(state_machine_arn, fingerprint, response.get('revisionId'))
+    return state_machine_arn
 
-    # S3 Locations of processing baseline and testing data.
-    s3_bucket_base_uri = "s3://{}".format(args.pipeline_bucket)
-    input_data_prefix = os.path.join(s3_bucket_base_uri, job_id, 'input')
-    output_data_prefix = os.path.join(s3_bucket_base_uri, job_id)
-    preprocessed_baseline_data = "{}/{}".format(input_data_prefix, 'baseline')
-    output_baseline_report_s3_uri = "{}/{}".format(output_data_prefix,"baseline_report")
-    output_model_evaluation_s3_uri = "{}/{}".format(output_data_prefix,"evaluation")
-    model_s3_uri = "{}/{}/mlops-{}-{}/{}".format(s3_bucket_base_uri, job_id, args.model_name, job_id, "output/model.tar.gz")
-    
-    logger.info("********************** System Test Parameters **********************")
-    logger.info(s3_bucket_base_uri)
-    logger.info(input_data_prefix)
-    logger.info(output_data_prefix)
-    logger.info(preprocessed_baseline_data)
-    logger.info(output_baseline_report_s3_uri)
-    logger.info(output_model_evaluation_s3_uri)
-    logger.info(model_s3_uri)
-    
+
+def build_workflow_graph(execution_input, pipeline_bucket, evaluate_lambda_arn, register_lambda_arn,
+                         image_uri, baseline_image_uri, processing_role, threshold, suggest_baseline=True):
+    """ Build the System Test workflow graph.
+
+    The graph only depends on its arguments, so it can be built and checked
+    locally, e.g. `Graph(build_workflow_graph(...)).to_json(pretty=True)` with
+    `stepfunctions.steps.states.Graph`.
+
+    Args:
+        execution_input: (ExecutionInput) Placeholders of the execution input.
+        pipeline_bucket: (str) Pipeline S3 Bucket.
+        evaluate_lambda_arn: (str) Evaluate Endpoint Lambda ARN.
+        register_lambda_arn: (str) Register Model Lambda ARN.
+        image_uri: (str) Model container image URI.
+        baseline_image_uri: (str) Model Monitor analyzer image URI.
+        processing_role: (str) Baseline Processing Job role ARN.
+        threshold: (float) Maximum evaluation result of an approved model.
+        suggest_baseline: (bool) Run the baseline Processing Job, False when the
+            baseline is computed locally.
+
+    Returns: The workflow graph.
+    """
     # Create the Lambda Function `configure_output` Step 
     evaluate_endpoint_step = LambdaStep(
         "Evaluate SageMaker Hosted Model",
         parameters={
-            "FunctionName": get_lambda_arn(args.model_name, 'EvaluateEndpoint'),
+            "FunctionName": evaluate_lambda_arn,
             "Payload": {
                 "Endpoint_Name": execution_input['EndpointName'],
-                "Bucket": args.pipeline_bucket,
-                "Key": "{}/input/testing/test.csv".format(job_id),
-                "Output_Key": "{}/evaluation".format(job_id)
+                "Bucket": pipeline_bucket,
+                "Key": execution_input['TestingKey'],
+                "Output_Key": execution_input['EvaluationKey']
             }
         }
     )
@@ -202,14 +241,14 @@ if __name__ == "__main__":
     register_model_step = LambdaStep(
         "Register Production Model",
         parameters={
-            "FunctionName": get_lambda_arn(args.model_name, 'RegisterModel'),
+            "FunctionName": register_lambda_arn,
             "Payload": {
                 "Model_Name": execution_input['ModelName'],
                 "Group_Name": execution_input['ModelGroup'],
-                "Model_Uri": model_s3_uri,
+                "Model_Uri": execution_input['ModelUri'],
                 "Image_Uri": image_uri,
-                "Job_Id": job_id,
-                "Evaluation_Uri": os.path.join(output_model_evaluation_s3_uri, "evaluation.json")
+                "Job_Id": execution_input['JobId'],
+                "Evaluation_Uri": execution_input['EvaluationUri']
             }
         }
 
@@ -219,11 +258,11 @@ if __name__ == "__main__":
     baseline_step = ProcessingStep(
         "Suggest Baseline",
         processor=Processor(
-            image_uri=get_baseline_uri(region),
+            image_uri=baseline_image_uri,
             instance_count=1,
             instance_type="ml.m5.xlarge",
             volume_size_in_gb=30,
-            role=role,
+            role=processing_role,
             max_runtime_in_seconds=1800,
             env={
                 "dataset_format": "{\"csv\": {\"header\": true, \"output_columns_position\": \"START\"}}",
@@ -235,7 +274,7 @@ if __name__ == "__main__":
         job_name=execution_input["BaselineProcessingJobName"],
         inputs=[
             ProcessingInput(
-                source="{}/{}".format(preprocessed_baseline_data, "baseline.csv"),
+                source="s3://{}/baseline.csv".format(pipeline_bucket),
                 destination="/opt/ml/processing/input/baseline_dataset_input",
                 input_name="baseline_dataset_input"
             )
@@ -243,18 +282,15 @@ if __name__ == "__main__":
         outputs=[
             ProcessingOutput(
                 source="/opt/ml/processing/output",
-                destination=output_baseline_report_s3_uri,
+                destination="s3://{}/baseline_report".format(pipeline_bucket),
                 output_name="monitoring_output"
             )
         ]
     )
 
-    # Create a `Parallel` Step to simultaneously run the `baseline` and `register_model` steps
-    parallel_step = stepfunctions.steps.states.Parallel(
-        "Finalize Production Model",
-    )
-    parallel_step.add_branch(baseline_step)
-    parallel_step.add_branch(register_model_step)
+    # Baseline locations of the current execution from the execution input
+    baseline_step.parameters['ProcessingInputs'][0]['S3Input']['S3Uri'] = execution_input['BaselineDataUri']
+    baseline_step.parameters['ProcessingOutputConfig']['Outputs'][0]['S3Output']['S3Uri'] = execution_input['BaselineReportUri']
 
     # Create `Fail` states to mark the workflow failed in case any of the steps fail
     workflow_failed_state = stepfunctions.steps.states.Fail(
@@ -271,8 +307,8 @@ if __name__ == "__main__":
         "Model Below Quality Threshold"
     )
 
-    # Add the baseline step after the `Pass` state
-    threshold_pass_state.next(parallel_step)
+    # Only the model registration waits on the evaluation
+    threshold_pass_state.next(register_model_step)
 
     # Create Threshold PASS | Fail Branch Step
     check_threshold_step = steps.states.Choice(
@@ -282,7 +318,7 @@ if __name__ == "__main__":
     # Set rule to evaluate the results of the Analysis Step with the Threshold value
     threshold_rule = steps.choice_rule.ChoiceRule.NumericLessThan(
         variable=evaluate_endpoint_step.output()['Payload']['Result'],
-        value=float(os.environ["THRESHOLD"])
+        value=threshold
     )
 
     # If results less than threshold, workflow is successful
@@ -291,24 +327,120 @@ if __name__ == "__main__":
     # If results above threshold, workflow failed
     check_threshold_step.default_choice(next_step=threshold_fail_state)
 
+    # Create a `Parallel` Step to run the baseline while the endpoint is evaluated,
+    # the baseline only depends on the ETL output
+    parallel_step = stepfunctions.steps.states.Parallel(
+        "Test and Baseline Model",
+    )
+    parallel_step.add_branch(Chain([evaluate_endpoint_step, check_threshold_step]))
+    if suggest_baseline:
+        parallel_step.add_branch(baseline_step)
+
     # Define `catch` Step to catch any step failures
     catch_state = stepfunctions.steps.states.Catch(
         error_equals=["States.TaskFailed"],
         next_step=workflow_failed_state,
     )
 
-    # Add catch block to workflow steps
-    evaluate_endpoint_step.add_catch(catch_state)
+    # Add catch block to the workflow, failures of either branch end the `Parallel` step
     parallel_step.add_catch(catch_state)
 
     # Define the workflow graph
-    workflow_graph = Chain(
+    return Chain(
         [
-            evaluate_endpoint_step,
-            check_threshold_step
+            parallel_step
         ]
     )
 
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pipeline-name", type=str, default=os.environ["PIPELINE_NAME"])
+    parser.add_argument("--image-repo-name", type=str, default=os.environ["IMAGE_REPO_NAME"])
+    parser.add_argument("--image-tag", type=str, default=os.environ["IMAGE_TAG"])
+    parser.add_argument("--model-name", type=str, default=os.environ["MODEL_NAME"])
+    parser.add_argument("--model-package-group-name", type=str, default=os.environ["MODEL_GROUP"])
+    parser.add_argument("--test-endpoint", type=str, default="{}-dev-endpoint".format(os.environ["MODEL_NAME"]))
+    parser.add_argument("--pipeline-bucket", type=str, default=os.environ["PIPELINE_BUCKET"])
+    parser.add_argument("--local-baseline", action="store_true", default=os.environ.get("LOCAL_BASELINE", "false") == "true",
+                        help="Compute the baseline statistics and constraints in this build instead of a Processing Job")
+    args, _ = parser.parse_known_args()
+
+    # Configure logging to output the line number and message
+    log_format = "%(levelname)s: [%(filename)s:%(lineno)s] %(message)s"
+    logging.basicConfig(format=log_format, level=os.environ.get("LOGLEVEL", "INFO").upper())
+
+    # Client Session
+    sagemaker_session = sagemaker.Session()
+    region = sagemaker_session.boto_region_name
+    account_id = boto3.client('sts').get_caller_identity()["Account"]
+    role = sagemaker.session.get_execution_role()
+
+    # Configure workflow variables for current execution
+    job_id = get_job_id(args.pipeline_name)
+    baseline_job_name = "{}-baseline-{}".format(args.model_name, job_id[-12:])
+    image_uri = "{}.dkr.ecr.{}.amazonaws.com/{}:{}".format(account_id, region, args.image_repo_name, args.image_tag)
+
+    """
+    SageMaker expects unique names for each job, model and endpoint.
+
+    NOTE: If these names are not unique the execution will fail.
+          Pass these dynamically for each execution using placeholders.
+          Execution specific locations are passed the same way, so the
+          workflow definition only changes when this script changes.
+    """
+    execution_input = ExecutionInput(
+        schema={
+            "ModelName": str,
+            "ModelGroup": str,
+            "EndpointName": str,
+            "BaselineProcessingJobName": str,
+            "JobId": str,
+            "TestingKey": str,
+            "EvaluationKey": str,
+            "EvaluationUri": str,
+            "ModelUri": str,
+            "BaselineDataUri": str,
+            "BaselineReportUri": str
+        }
+    )
+
+    # S3 Locations of processing baseline and testing data.
+    s3_bucket_base_uri = "s3://{}".format(args.pipeline_bucket)
+    input_data_prefix = os.path.join(s3_bucket_base_uri, job_id, 'input')
+    output_data_prefix = os.path.join(s3_bucket_base_uri, job_id)
+    preprocessed_baseline_data = "{}/{}".format(input_data_prefix, 'baseline')
+    output_baseline_report_s3_uri = "{}/{}".format(output_data_prefix,"baseline_report")
+    output_model_evaluation_s3_uri = "{}/{}".format(output_data_prefix,"evaluation")
+    model_s3_uri = "{}/{}/mlops-{}-{}/{}".format(s3_bucket_base_uri, job_id, args.model_name, job_id, "output/model.tar.gz")
+    
+    logger.info("********************** System Test Parameters **********************")
+    logger.info(s3_bucket_base_uri)
+    logger.info(input_data_prefix)
+    logger.info(output_data_prefix)
+    logger.info(preprocessed_baseline_data)
+    logger.info(output_baseline_report_s3_uri)
+    logger.info(output_model_evaluation_s3_uri)
+    logger.info(model_s3_uri)
+    
+    # Define the workflow graph
+    workflow_graph = build_workflow_graph(
+        execution_input,
+        pipeline_bucket=args.pipeline_bucket,
+        evaluate_lambda_arn=get_lambda_arn(args.model_name, 'EvaluateEndpoint'),
+        register_lambda_arn=get_lambda_arn(args.model_name, 'RegisterModel'),
+        image_uri=image_uri,
+        baseline_image_uri=get_baseline_uri(region),
+        processing_role=role,
+        threshold=float(os.environ["THRESHOLD"]),
+        suggest_baseline=not args.local_baseline
+    )
+
+    # Baseline the ETL output in the build, in seconds rather than a Processing Job
+    if args.local_baseline:
+        logger.info("Computing baseline statistics and constraints ...")
+        baseline.suggest("{}/{}".format(preprocessed_baseline_data, "baseline.csv"), output_baseline_report_s3_uri)
+
     # Define the workflow
     workflow = Workflow(
         name=os.environ['WORKFLOW_NAME'],
@@ -316,18 +448,8 @@ if __name__ == "__main__":
         role=get_workflow_role(args.model_name)
     )
 
-    # Create State Machine
-    try:
-        logger.info("Creating workflow ...")
-        workflow.create()
-    except sfn.exceptions.StateMachineAlreadyExists:
-        logger.info("Found existing workflow, updating the State Machine definition ...")
-    
-    else:
-        # Update workflow
-        workflow.update(workflow_graph)
-        # Wait 60 seconds to ensure that definition has been updated before execution
-        time.sleep(60)
+    # Create or update the State Machine
+    deploy_workflow(workflow)
 
     # Create JSON file of the current execution variables
     with open("input.json", "w") as json_file:
@@ -336,7 +458,14 @@ if __name__ == "__main__":
                 "ModelName": args.model_name,
                 "ModelGroup": args.model_package_group_name,
                 "EndpointName": args.test_endpoint,
-                "BaselineProcessingJobName": baseline_job_name
+                "BaselineProcessingJobName": baseline_job_name,
+                "JobId": job_id,
+                "TestingKey": "{}/input/testing/test.csv".format(job_id),
+                "EvaluationKey": "{}/evaluation".format(job_id),
+                "EvaluationUri": os.path.join(output_model_evaluation_s3_uri, "evaluation.json"),
+                "ModelUri": model_s3_uri,
+                "BaselineDataUri": "{}/{}".format(preprocessed_baseline_data, "baseline.csv"),
+                "BaselineReportUri": output_baseline_report_s3_uri
             },
             json_file
         )
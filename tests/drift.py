@@ -0,0 +1,317 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+import baseline
+
+logger = logging.getLogger(__name__)
+
+# Incremental state and report written to the state location
+state_file = 'drift_state.json'
+report_file = 'drift_report.json'
+
+# Capture records parsed per batch
+batch_lines = 10000
+
+# Baseline quantiles bounding the PSI bins of numerical features
+bin_fractions = np.linspace(0.1, 0.9, 9)
+
+# Drift thresholds, a PSI above 0.2 is commonly read as a significant shift
+psi_threshold = 0.2
+ks_threshold = 0.1
+
+# Runs with fewer rows are judged on all data consumed so far, small samples are noisy
+min_rows = 1000
+
+# Floor of bin proportions, keeps the PSI finite for empty bins
+epsilon = 1e-4
+
+
+def is_numerical(feature):
+    """ Whether a baseline feature has numerical statistics, categorical features are not summarized.
+    """
+    return feature["inferred_type"] in ("Integral", "Fractional") and "numerical_statistics" in feature
+
+
+def get_fingerprint(statistics):
+    """ Hash of the baseline statistics, the drift state only applies to the baseline it was built on.
+    """
+    return hashlib.sha1(json.dumps(statistics, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def is_binary(feature):
+    """ Whether a baseline feature is a 0/1 indicator, e.g. a one-hot column.
+    """
+    stats = feature.get("numerical_statistics")
+    return feature["inferred_type"] == "Integral" and stats["min"] >= 0 and stats["max"] <= 1
+
+
+def get_psi(expected, actual):
+    """ Population stability index between two binned distributions.
+
+    Args:
+        expected: (NumPy) Baseline bin counts or proportions.
+        actual: (NumPy) Current bin counts or proportions.
+
+    Returns: The PSI.
+    """
+    expected = np.maximum(np.asarray(expected, dtype=float) / max(np.sum(expected), 1), epsilon)
+    actual = np.maximum(np.asarray(actual, dtype=float) / max(np.sum(actual), 1), epsilon)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+class FeatureDrift(object):
+    """ Mergeable summary of the captured values of a feature.
+
+    Numerical features keep counts over bins fixed by the baseline quantiles and
+    a quantile sketch, indicator features the count of ones.
+    """
+    def __init__(self, feature):
+        self.name = feature["name"]
+        self.binary = is_binary(feature)
+        self.count = 0
+        if self.binary:
+            self.ones = 0
+            self.expected = np.array([1 - feature["numerical_statistics"]["mean"], feature["numerical_statistics"]["mean"]])
+        else:
+            self.baseline_sketch = baseline.QuantileSketch.from_dict(
+                feature["numerical_statistics"]["distribution"]["kll"]["sketch"])
+            self.edges = np.unique(self.baseline_sketch.quantile(bin_fractions))
+            self.expected = np.diff(np.concatenate([[0.0], self.baseline_sketch.cdf(self.edges), [1.0]]))
+            self.counts = np.zeros(len(self.edges) + 1)
+            self.sketch = baseline.QuantileSketch()
+
+    def update(self, values):
+        """ Add a batch of values, missing values are ignored.
+        """
+        values = values[~np.isnan(values)]
+        self.count += len(values)
+        if self.binary:
+            self.ones += int(np.sum(values == 1))
+        else:
+            # Bins are closed on the right, like the baseline CDF
+            self.counts += np.bincount(np.searchsorted(self.edges, values, side='left'), minlength=len(self.counts))
+            self.sketch.update(values)
+
+    def merge(self, other):
+        self.count += other.count
+        if self.binary:
+            self.ones += other.ones
+        else:
+            self.counts += other.counts
+            self.sketch.merge(other.sketch)
+
+    def distances(self):
+        """ PSI and Kolmogorov-Smirnov distance from the baseline.
+        """
+        if self.count == 0:
+            return {"count": 0, "psi": None, "ks": None}
+        if self.binary:
+            actual = np.array([self.count - self.ones, self.ones])
+            ks = abs(self.ones / self.count - self.expected[1])
+        else:
+            actual = self.counts
+            points = np.union1d(self.baseline_sketch.weighted_items()[0], self.sketch.weighted_items()[0])
+            ks = float(np.max(np.abs(self.baseline_sketch.cdf(points) - self.sketch.cdf(points))))
+        return {"count": self.count, "psi": get_psi(self.expected, actual), "ks": ks}
+
+    def to_dict(self):
+        if self.binary:
+            return {"count": self.count, "ones": self.ones}
+        return {"count": self.count, "counts": self.counts.tolist(), "sketch": self.sketch.to_dict()}
+
+    def load(self, state):
+        self.count = state["count"]
+        if self.binary:
+            self.ones = state["ones"]
+        else:
+            self.counts = np.asarray(state["counts"])
+            self.sketch = baseline.QuantileSketch.from_dict(state["sketch"])
+
+
+class DriftMonitor(object):
+    """ Incremental drift analysis of captured endpoint traffic against the
+    training baseline.
+
+    Captured rows are matched to the baseline columns by position, the
+    prediction column and categorical features are skipped. Offsets of the capture files are kept with
+    the summaries, so each run only reads the bytes added since the last one,
+    and capture batches of the serving container are read once.
+    """
+    def __init__(self, statistics):
+        self.statistics = statistics
+        self.fingerprint = get_fingerprint(statistics)
+        # Capture column of each summarized feature, after the prediction column
+        self.columns = [i + 1 for i, feature in enumerate(statistics["features"][1:]) if is_numerical(feature)]
+        self.features = self.get_summaries()
+        self.offsets = {}
+        skipped = [feature["name"] for feature in statistics["features"][1:] if not is_numerical(feature)]
+        if skipped:
+            logger.info("Skipping categorical features: {}".format(skipped))
+
+    def get_summaries(self):
+        """ Empty summaries of the numerical features.
+        """
+        return [FeatureDrift(self.statistics["features"][column]) for column in self.columns]
+
+    def consume(self, source, summaries):
+        """ Read the complete records added to a capture file since its last offset.
+
+        Args:
+            source: (str) Local path or S3 URI of a capture file.
+            summaries: (list) Feature summaries of this run.
+
+        Returns: The number of rows read.
+        """
+        if source.endswith('.npz'):
+            return self.consume_batch(source, summaries)
+
+        offset = self.offsets.get(source, 0)
+        if source.startswith('s3://'):
+            # Capture objects are written once, a known object has been read
+            if source in self.offsets:
+                return 0
+            with baseline.open_file(source) as f:
+                data = f.read()
+        else:
+            if os.path.getsize(source) <= offset:
+                return 0
+            with open(source, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+
+        # A record still being written is read by the next run
+        end = data.rfind(b'\n') + 1 if not source.startswith('s3://') else len(data)
+        lines = data[:end].decode('utf-8').splitlines()
+        rows = 0
+        for start in range(0, len(lines), batch_lines):
+            try:
+                frame = baseline.parse_capture(lines[start:start + batch_lines])
+            except ValueError as e:
+                logger.warning("Skipping records of {}: {}".format(source, e))
+                continue
+            rows += self.add(frame, summaries, source)
+        self.offsets[source] = offset + end
+        return rows
+
+    def consume_batch(self, source, summaries):
+        """ Read a capture batch of the serving container, batches are written once.
+
+        Returns: The number of rows read.
+        """
+        if source in self.offsets:
+            return 0
+        try:
+            frame = baseline.parse_capture_batch(baseline.load_capture_batch(source))
+        except ValueError as e:
+            logger.warning("Skipping capture batch {}: {}".format(source, e))
+            frame = None
+        self.offsets[source] = 1
+        return self.add(frame, summaries, source)
+
+    def add(self, frame, summaries, source):
+        """ Add parsed capture rows to the feature summaries, the prediction column is skipped.
+
+        Returns: The number of rows added.
+        """
+        if frame is None:
+            return 0
+        if frame.shape[1] != len(self.statistics["features"]):
+            logger.warning("Skipping {} rows of {} with {} columns, expected {}".format(
+                len(frame), source, frame.shape[1], len(self.statistics["features"])))
+            return 0
+        # Only the numerical columns are converted, unparseable values are missing
+        values = frame.iloc[:, self.columns].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+        for i, summary in enumerate(summaries):
+            summary.update(values[:, i])
+        return len(frame)
+
+    def run(self, capture_uri):
+        """ Consume the new capture data and compute the drift distances.
+
+        Args:
+            capture_uri: (str) Local directory or S3 prefix of data capture `.jsonl` files
+                or capture batches `.npz` of the serving container.
+
+        Returns: The drift report of the new data and of all data consumed so far.
+        """
+        summaries = self.get_summaries()
+        rows = sum(self.consume(source, summaries) for source in baseline.list_files(capture_uri, baseline.capture_suffixes))
+        for total, summary in zip(self.features, summaries):
+            total.merge(summary)
+
+        report = {"rows": rows, "total_rows": self.features[0].count if self.features else 0, "features": {}, "drifted": []}
+        for total, summary in zip(self.features, summaries):
+            current, cumulative = summary.distances(), total.distances()
+            report["features"][total.name] = {"run": current, "cumulative": cumulative}
+            judged = current if rows >= min_rows else cumulative
+            if judged["psi"] is not None and (judged["psi"] > psi_threshold or judged["ks"] > ks_threshold):
+                report["drifted"].append(total.name)
+        return report
+
+    def to_dict(self):
+        return {"baseline": self.fingerprint, "offsets": self.offsets,
+                "features": [feature.to_dict() for feature in self.features]}
+
+    @classmethod
+    def load(cls, statistics, state=None):
+        """ Create a monitor from the baseline statistics and the state of a previous run.
+
+        A state built on other baseline statistics is discarded, the monitor starts over.
+        """
+        monitor = cls(statistics)
+        if state is not None and state.get("baseline") != monitor.fingerprint:
+            logger.info("Baseline statistics changed, reading all capture data")
+            state = None
+        if state is not None:
+            monitor.offsets = state["offsets"]
+            for feature, feature_state in zip(monitor.features, state["features"]):
+                feature.load(feature_state)
+        return monitor
+
+
+def run(baseline_uri, capture_uri, state_uri, reset=False):
+    """ Run the drift analysis over the capture data added since the previous run.
+
+    Args:
+        baseline_uri: (str) Directory or S3 prefix of the baseline `statistics.json`.
+        capture_uri: (str) Local directory or S3 prefix of data capture files.
+        state_uri: (str) Directory or S3 prefix of the drift state and report.
+        reset: (bool) Start over from the beginning of the capture data.
+
+    Returns: The drift report.
+    """
+    statistics = baseline.read_json(baseline_uri, "statistics.json")
+    state = None
+    if not reset:
+        try:
+            state = baseline.read_json(state_uri, state_file)
+        except Exception:
+            logger.info("No drift state found, reading all capture data")
+
+    monitor = DriftMonitor.load(statistics, state)
+    report = monitor.run(capture_uri)
+    baseline.write_json(state_uri, state_file, monitor.to_dict())
+    baseline.write_json(state_uri, report_file, report)
+    logger.info("Read {} new rows, drifted features: {}".format(report["rows"], report["drifted"]))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("baseline", type=str, help="Directory or S3 prefix of the baseline reports")
+    parser.add_argument("capture", type=str, help="Directory or S3 prefix of the data capture files")
+    parser.add_argument("state", type=str, help="Directory or S3 prefix of the drift state and report")
+    parser.add_argument("--reset", action="store_true", help="Discard the state of previous runs")
+    parser.add_argument("--fail-on-drift", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(levelname)s: [%(filename)s:%(lineno)s] %(message)s",
+                        level=os.environ.get("LOGLEVEL", "INFO").upper())
+
+    report = run(args.baseline, args.capture, args.state, reset=args.reset)
+    if args.fail_on_drift and report["drifted"]:
+        raise SystemExit(1)